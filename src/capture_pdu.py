@@ -1,17 +1,69 @@
 import argparse
+import signal
+import sys
+import threading
 import time
 
+from listeners.live_query import LiveQueryServer
+from listeners.live_query import RecentSamplesStage
 from listeners.pdu_listener import PDUListener
+from settings import settings
+
+
+def rotate_segments(listener, interval, kept, stopped):
+    # Nothing collects the daemon's segments, so they are sealed on a timer and only the newest ones are kept
+    while not stopped.wait(interval):
+        sealed = listener.seal_segment()
+        listener.discard_segments(sealed[:len(sealed) - kept])
+
+
+def run_daemon(listener, sample_rate, socket_path, history):
+    stage = RecentSamplesStage(PDUListener.METRICS, capacity=int(history * sample_rate))
+    listener.add_stage(stage)
+
+    server = LiveQueryServer(socket_path, stage, lambda: listener.outlet_names)
+
+    # Shut down cleanly when the daemon is stopped by its service manager
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    listener.start()
+    print("[PDU] Serving live queries on " + socket_path)
+
+    stopped = threading.Event()
+    rotation = threading.Thread(target=rotate_segments, daemon=True,
+                                args=(listener, settings.PDU_SEGMENT_ROTATION, settings.PDU_SEGMENTS_KEPT, stopped))
+    rotation.start()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        rotation.join()
+
+        server.server_close()
+        listener.stop()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Listen for energy values of PDU outlets")
-    parser.add_argument("-outlets", metavar="[0,17]", required=True, nargs="+")
-    parser.add_argument("-duration", metavar="seconds", required=True, type=int)
-    parser.add_argument("-exp", type=str, required=True)
+    parser.add_argument("-outlets", metavar="[0,17]", required=True, nargs="+", type=int)
+    parser.add_argument("-duration", metavar="seconds", type=int)
+    parser.add_argument("-rate", metavar="Hz", type=float, default=4)
+    parser.add_argument("-daemon", action="store_true", help="run until stopped and answer queries on -socket")
+    parser.add_argument("-socket", default=settings.PDU_SOCKET_PATH)
+    parser.add_argument("-history", metavar="seconds", type=float, default=settings.PDU_LIVE_HISTORY)
     args = parser.parse_args()
 
-    listener = PDUListener(sample_rate=4, outlets=args.outlets, experiment=args.exp)
-    listener.start()
-    time.sleep(int(args.duration))
-    listener.stop()
+    if not args.daemon and args.duration is None:
+        parser.error("-duration is required unless -daemon is given")
+
+    listener = PDUListener(sample_rate=args.rate, outlets=args.outlets)
+
+    if args.daemon:
+        run_daemon(listener, args.rate, args.socket, args.history)
+    else:
+        listener.start()
+        time.sleep(int(args.duration))
+        listener.stop()
@@ -1,16 +1,25 @@
+import multiprocessing
 import os
 import json
 import time
-import statistics
 
 import ciso8601
+import numpy as np
 
 from datetime import datetime
+from data_collector.ingest_checkpoint import IngestCheckpoint
+from data_collector.run_aggregates import RunAggregates
+from data_collector.run_index import RunIntervalIndex
+from data_collector.staging_store import StagingStore
 from listeners.arduino_power_listener import ArduinoPowerListener
 from listeners.pdu_listener import PDUListener
+from listeners.process_listener import ProcessListener
+from listeners.rapl_listener import RAPLListener
 from error_handling.error_handler import ErrorHandler
+from settings import settings
 from utility import path_handler
 from utility.utilities import get_size
+from utility.utilities import ns_to_datetime
 
 
 class DataCollector:
@@ -22,139 +31,306 @@ class DataCollector:
         self.dry_run = dry_run
         self.listeners = listeners
 
+        # A dry run stages the rows in a local file instead, it is pushed to the database by staging_store later
+        self.store = StagingStore() if dry_run else db
+        self.checkpoint = IngestCheckpoint()
+
+        # run_schedule IDs of the runs inserted by this collector
+        self.run_ids = []
+
     def add_listener(self, listener):
         self.listeners.append(listener)
 
     def collect(self):
+        # Settle a step a crashed collect left behind before anything new is read
+        self.checkpoint.recover(self.store)
+
+        # Listeners keep sampling into a fresh segment while the sealed ones are ingested
+        segments = {}
         for listener in self.listeners:
-            listener.pause()
+            segments[listener] = listener.seal_segment()
+            source = self.__get_source(listener)
+
+            stats = listener.get_timing_stats()
+            if stats is not None:
+                print("[" + source.__class__.__name__ + "] Sampled at " + str(round(stats["achieved_rate"], 2))
+                      + "/" + str(stats["sample_rate"]) + " Hz, missed ticks: " + str(stats["missed_ticks"])
+                      + ", jitter p95: " + str(round((stats["jitter_p95"] or 0) * 1000, 2)) + "ms")
+
+            if isinstance(source, ArduinoPowerListener):
+                for channel, rate in listener.get_channel_rates().items():
+                    print("[" + source.__class__.__name__ + "] " + channel + ": " + str(round(rate, 2)) + " Hz")
 
         # time_schedule = []
 
         print("[DB] Insert performance measures")
         start_time = time.time()
 
-        sched_id = self.db.get_free_index("run_schedule")
-        eval_id = self.db.get_free_index("run_eval")
+        paths = []
+        for (dirpath, dirnames, filenames) in os.walk(path_handler.slurm_nfs_bench_perf_root):
+            paths.extend(os.path.join(dirpath, x) for x in sorted(filenames) if x.endswith(".ldjson"))
+
+        self.checkpoint.forget_missing_files(paths)
 
-        sched_data = []
-        eval_data = []
+        # Only files that grew since the last collect are read, starting where it stopped
+        files = []
+        for file_path in paths:
+            size, identity, offset = self.checkpoint.stat_file(file_path)
 
-        for (dirpath, dirnames, filenames) in os.walk(path_handler.slurm_nfs_bench_perf_root):
-            for filename in filenames:
-                path = os.path.join(dirpath, filename)
+            if size > offset:
+                files.append((file_path, identity, offset))
 
-                if filename.endswith(".ldjson"):
-                    with open(path) as file:
-                        for line in file:
-                            data = json.loads(line)
-                            begin_work = ciso8601.parse_datetime(data["begin"])
-                            end_work = ciso8601.parse_datetime(data["end"])
+        walk_time = time.time() - start_time
+        parse_time = 0
+        wait_time = 0
+        insert_time = 0
+        runs = 0
 
-                            completion_time = (end_work - begin_work)
+        run_rows = []
+        file_offsets = {}
 
-                            begin_job = ciso8601.parse_datetime(data["job_begin"])
-                            end_job = ciso8601.parse_datetime(data["job_end"])
+        # Files are parsed in worker processes while the rows of the files finished so far are inserted here.
+        # Workers are started by a forkserver, a fork of this process would copy the locks its listener and
+        # database threads hold at that moment.
+        context = multiprocessing.get_context("forkserver")
+        with context.Pool(processes=settings.DATA_PARSE_WORKERS) as pool:
+            wait_start = time.time()
 
-                            peak = ciso8601.parse_datetime(data["peak"])
+            for (rows, offset, duration), (file_path, identity, _) in zip(
+                    pool.imap(parse_perf_task, [(x[0], x[2]) for x in files]), files):
+                wait_time += time.time() - wait_start
+                parse_time += duration
+                file_offsets[file_path] = dict(identity, offset=offset)
 
-                            sched_data.append([
-                                str(sched_id),
-                                str(data["run_spec_id"]),
-                                str(data["repetition"]),
-                                str(data["host"]),
-                                begin_job.strftime("%Y-%m-%d %H:%M:%S.%f"),
-                                end_job.strftime("%Y-%m-%d %H:%M:%S.%f"),
-                                begin_work.strftime("%Y-%m-%d %H:%M:%S.%f"),
-                                end_work.strftime("%Y-%m-%d %H:%M:%S.%f"),
-                                peak.strftime("%Y-%m-%d %H:%M:%S.%f")]
-                            )
+                run_rows.extend(rows)
 
-                            eval_data.append([str(eval_id), str(sched_id), "OK", str(completion_time)])
+                if len(run_rows) >= settings.DATA_INSERT_BATCH_SIZE:
+                    runs += len(run_rows)
+                    insert_time += self.__insert_runs(run_rows, file_offsets)
+                    run_rows = []
+                    file_offsets = {}
 
-                            sched_id += 1
-                            eval_id += 1
+                wait_start = time.time()
 
-        self.db.insert_data("run_schedule", sched_data)
-        self.db.insert_data("run_eval", eval_data,
-                            fields=["id", "run", "status", "completion_time"])
+        runs += len(run_rows)
+        insert_time += self.__insert_runs(run_rows, file_offsets)
 
+        print("[DB] Inserted " + str(runs) + " runs from " + str(len(files)) + " new or grown files, walk: "
+              + str(round(walk_time, 2)) + "s, parse: " + str(round(parse_time, 2)) + "s in "
+              + str(settings.DATA_PARSE_WORKERS) + " workers, waiting for parse: " + str(round(wait_time, 2))
+              + "s, insert: " + str(round(insert_time, 2)) + "s")
         print("[DB] Done in : " + str(round(time.time() - start_time, 2)) + "s")
 
         print("[DB] Insert power measurements")
-        measurement_id = self.db.get_free_index("measurements")
 
         for listener in self.listeners:
-            if isinstance(listener, ArduinoPowerListener):
+            source = self.__get_source(listener)
+
+            # Segments up to the checkpoint were ingested by a collect that died before discarding them
+            sequences = dict((x[1], x[0]) for x in source.list_segments())
+            last_ingested = self.checkpoint.get_segment(source.segment_name)
+            ingested = [x for x in segments[listener] if sequences[x] <= last_ingested]
+            segments[listener] = [x for x in segments[listener] if x not in ingested]
+
+            if len(ingested) > 0:
+                print("[DB] Discard " + str(len(ingested)) + " segments ingested before")
+                listener.discard_segments(ingested)
+
+            if len(segments[listener]) == 0:
+                continue
+
+            # Outlets are named after the host they power
+            if isinstance(source, PDUListener):
+                hosts = [x for x in source.get_outlet_names() if x is not None]
+            else:
+                hosts = [source.host if isinstance(source, RAPLListener) else source.assembled_host]
+
+            # Only the runs of the listener's hosts while its segments were sampled, not the whole run history.
+            # Loaded after the runs above were inserted, so samples of the runs just collected find them.
+            start_time = time.time()
+            span = source.get_time_span(segments[listener])
+            if span is None:
+                run_index = RunIntervalIndex([])
+            else:
+                run_index = RunIntervalIndex(self.store.get_run_intervals(hosts, ns_to_datetime(span[0]),
+                                                                          ns_to_datetime(span[1])))
+            print("[DB] Loaded " + str(len(run_index)) + " runs in " + str(round(time.time() - start_time, 2)) + "s")
+
+            first_id = None
+
+            if isinstance(source, (ArduinoPowerListener, RAPLListener)):
                 print("[DB] Insert fine-grained measurements")
-                power_data = {}
                 start_time = time.time()
-                for data in listener.get_data():
-                    if data is not None:
-                        pass
-                        # if sched_id_time[0] <= data["timestamp"] <= sched_id_time[1]:
-                        #     sched_id = sched_id_time[2]
-                        #
-                        #     component = listener.translate_component_to_table(data["component"])
-                        #
-                        #     if component is not None:
-                        #         fields = ("id", "timestamp", "run", component)
-                        #
-                        #         try:
-                        #             power_data[fields].append(
-                        #                 [str(measurement_id), str(data["timestamp"]),
-                        #                  str(sched_id), str(data["power"])])
-                        #         except KeyError:
-                        #             power_data[fields] = []
-                        #             power_data[fields].append(
-                        #                 [str(measurement_id), str(data["timestamp"]),
-                        #                  str(sched_id), str(data["power"])])
-                        #
-                        #         measurement_id += 1
-                        #
-                        #     break
-
-                # print("FOR LOOP TIME " + str(time.time() - start))
+                samples = 0
+
+                # Columns of new components are added first, a schema change would commit the listener's rows halfway
+                columns = [listener.translate_component_to_table(x) for x in source.get_components()]
+                columns = [x for x in columns if x is not None]
+                self.store.add_columns("measurements", columns, [0.0] * len(columns))
+
+                for chunk in listener.iter_chunks(segments[listener], resolution=settings.DATA_INGEST_RESOLUTION):
+                    runs = run_index.assign(chunk["timestamp"].values, hosts[0])
+
+                    chunk = chunk[runs >= 0].assign(run=runs[runs >= 0])
+
+                    # Every row holds one component, so rows are inserted per component column
+                    for component, group in chunk.groupby("component", observed=True):
+                        fields = ("id", "timestamp", "run", listener.translate_component_to_table(component))
+
+                        measurement_id = self.store.reserve_ids("measurements", len(group))
+                        if first_id is None:
+                            first_id = measurement_id
+
+                        measurements = []
+                        for timestamp, run, power in zip(group["timestamp"].tolist(), group["run"].tolist(),
+                                                         group["power"].tolist()):
+                            measurements.append((measurement_id, ns_to_datetime(timestamp), run, power))
+                            measurement_id += 1
+
+                        self.store.insert_rows("measurements", measurements, fields, commit=False)
+
+                    samples += len(chunk)
+
+                print("[DB] Inserted " + str(samples) + " fine-grained samples")
                 print("[DB] Done in : " + str(round(time.time() - start_time, 2)) + "s")
 
-            if isinstance(listener, PDUListener):
+            if isinstance(source, PDUListener):
                 print("[DB] Insert coarse-grained measurements")
-                average_power = {}
-                measurements = []
                 start_time = time.time()
 
-                for data in listener.get_data():
-                    sched_id = self.db.get_run_idx(data[0], data[1])
+                frame = source.get_frame(segments[listener], resolution=settings.DATA_INGEST_RESOLUTION)
+                runs = np.full(len(frame), -1, dtype=np.int64)
+                aggregates = RunAggregates()
 
-                    if sched_id is not None:
-                        measurements.append([
-                            str(measurement_id),
-                            str(data[0]),
-                            str(sched_id),
-                            str(data[2]),
-                            str(data[3]),
-                            str(data[4]),
-                            str(data[5])
-                        ])
+                for outlet, group in frame.groupby("outlet"):
+                    outlet_runs = run_index.assign(group["timestamp"].values, outlet)
+                    runs[group.index.values] = outlet_runs
 
-                        measurement_id += 1
+                    aggregates.add(outlet_runs, outlet, group["timestamp"].values, group["power_active"].values)
 
-                        if sched_id not in average_power:
-                            average_power[sched_id] = []
+                frame = frame[runs >= 0].assign(run=runs[runs >= 0])
 
-                        average_power[sched_id].append(data[2])
+                measurement_id = self.store.reserve_ids("measurements", len(frame))
+                if first_id is None:
+                    first_id = measurement_id
 
-                self.db.insert_data("measurements", measurements,
-                                    ("id", "timestamp", "run", "power_total_active", "power_total_apparent",
-                                     "current_total", "voltage_total"))
+                measurements = []
+                for timestamp, run, power_active, power_apparent, current, voltage in zip(
+                        frame["timestamp"].tolist(), frame["run"].tolist(),
+                        *[frame[x].tolist() for x in PDUListener.METRICS]):
+                    measurements.append(
+                        (measurement_id, ns_to_datetime(timestamp), run, power_active, power_apparent, current,
+                         voltage))
+                    measurement_id += 1
+
+                self.store.insert_rows("measurements", measurements,
+                                       ("id", "timestamp", "run", "power_total_active", "power_total_apparent",
+                                        "current_total", "voltage_total"), commit=False)
+
+                self.store.update_rows("run_eval", "run", list(settings.RUN_EVAL_AGGREGATES),
+                                       aggregates.get_rows(list(settings.RUN_EVAL_AGGREGATES.values())),
+                                       commit=False)
+
+                print("[DB] Inserted " + str(len(measurements)) + " coarse-grained samples")
+                print("[DB] Done in : " + str(round(time.time() - start_time, 2)) + "s")
 
-                average_power = dict(map(lambda x: (x, statistics.mean(average_power[x])), average_power))
+            # All measurements of the listener are committed in one transaction, announced to the checkpoint first
+            first_ids = {} if first_id is None else {"measurements": first_id}
+            self.checkpoint.begin(first_ids,
+                                  segments={source.segment_name: max(sequences[x] for x in segments[listener])})
 
-                for key, value in average_power.items():
-                    self.db.update_data("run_eval", ["power"], [str(value)], ["run"], [str(key)])
+            self.store.commit()
+            self.checkpoint.commit()
 
-                print("[DB] Done in : " + str(round(time.time() - start_time, 2)) + "s")
+            # Only reached once the inserts above were committed, a failed ingest keeps the segments
+            listener.discard_segments(segments[listener])
 
-            listener.resume()
+        if not self.dry_run:
+            stats = self.db.get_insert_stats()
+            if stats["rows_per_second"] is not None:
+                print("[DB] Inserted " + str(stats["rows"]) + " rows since start at "
+                      + str(round(stats["rows_per_second"])) + " rows/s")
 
         print("[DB] Done")
+
+    def __insert_runs(self, run_rows, file_offsets):
+        if len(file_offsets) == 0:
+            return 0
+
+        start_time = time.time()
+
+        first_ids = {}
+        sched_data = []
+        eval_data = []
+
+        if len(run_rows) > 0:
+            # IDs are reserved per batch, so other collectors can insert runs at the same time
+            sched_id = self.store.reserve_ids("run_schedule", len(run_rows))
+            eval_id = self.store.reserve_ids("run_eval", len(run_rows))
+            first_ids = {"run_schedule": sched_id, "run_eval": eval_id}
+
+            for i, row in enumerate(run_rows):
+                sched_data.append((sched_id + i,) + row[:-1])
+                eval_data.append((eval_id + i, sched_id + i, "OK", row[-1]))
+
+        # The file offsets only move on once both tables are committed
+        self.checkpoint.begin(first_ids, files=file_offsets)
+
+        self.store.insert_rows("run_schedule", sched_data, commit=False)
+        self.store.insert_rows("run_eval", eval_data, fields=["id", "run", "status", "completion_time"], commit=False)
+        self.store.commit()
+
+        self.checkpoint.commit()
+        self.run_ids.extend(x[0] for x in sched_data)
+
+        return time.time() - start_time
+
+    @staticmethod
+    def __get_source(listener):
+        # Listeners hosted in their own process are told apart by the listener they wrap
+        if isinstance(listener, ProcessListener):
+            return listener.listener
+
+        return listener
+
+
+def parse_perf_task(task):
+    # Pool.imap passes a single argument
+    return parse_perf_file(*task)
+
+
+def parse_perf_file(path, offset=0):
+    # Runs in a worker process. Rows are typed, datetimes are naive like the strftime strings stored before.
+    # Reads the complete lines after offset and returns the offset after the last of them.
+    start_time = time.process_time()
+    rows = []
+
+    with open(path, "rb") as file:
+        file.seek(offset)
+        content = file.read()
+
+    # A line still being written is left for the next collect
+    end = content.rfind(b"\n") + 1
+
+    for line in content[:end].splitlines():
+        if len(line.strip()) == 0:
+            continue
+
+        data = json.loads(line.decode())
+
+        begin_work = ciso8601.parse_datetime(data["begin"]).replace(tzinfo=None)
+        end_work = ciso8601.parse_datetime(data["end"]).replace(tzinfo=None)
+
+        rows.append((
+            data["run_spec_id"],
+            data["repetition"],
+            str(data["host"]),
+            ciso8601.parse_datetime(data["job_begin"]).replace(tzinfo=None),
+            ciso8601.parse_datetime(data["job_end"]).replace(tzinfo=None),
+            begin_work,
+            end_work,
+            ciso8601.parse_datetime(data["peak"]).replace(tzinfo=None),
+            end_work - begin_work
+        ))
+
+    return rows, offset + end, time.process_time() - start_time
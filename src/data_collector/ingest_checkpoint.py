@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import os.path as path
+
+from error_handling.error_handler import ErrorHandler
+from utility import path_handler
+
+
+class IngestCheckpoint:
+    # Remembers how far collect got: the byte offset of every result file and the last ingested segment of every
+    # listener. Files are told apart by inode and a fingerprint of their first line, result files are deleted and
+    # copied back under the same name before every collect, so a replaced or truncated file is read from the start.
+    # An ingest step is announced with the first IDs it inserts before its transaction is committed. If the
+    # process dies before the step is confirmed, the next collect checks for the first ID to tell whether the
+    # transaction was committed and either confirms the step or repeats it, so no row is inserted twice.
+    def __init__(self, checkpoint_path=path_handler.ingest_checkpoint_path):
+        self.path = checkpoint_path
+
+        self.files = {}  # path -> {"inode", "fingerprint", "offset"}
+        self.segments = {}  # listener segment name -> last ingested sequence number
+        self.pending = None
+
+        if path.exists(self.path):
+            with open(self.path) as checkpoint_file:
+                state = json.load(checkpoint_file)
+
+            self.files = state["files"]
+            self.segments = state["segments"]
+            self.pending = state["pending"]
+
+    def save(self):
+        # Replaced in one step, a crash leaves either the old or the new checkpoint behind
+        os.makedirs(path.dirname(self.path), exist_ok=True)
+
+        with open(self.path + ".tmp", "w") as checkpoint_file:
+            json.dump({"files": self.files, "segments": self.segments, "pending": self.pending}, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+
+        os.replace(self.path + ".tmp", self.path)
+
+    def stat_file(self, file_path):
+        # Size of file_path, its identity and the offset reading continues at
+        stat = os.stat(file_path)
+        identity = {"inode": stat.st_ino, "fingerprint": file_fingerprint(file_path)}
+
+        return stat.st_size, identity, self.get_offset(file_path, identity, stat.st_size)
+
+    def get_offset(self, file_path, identity, size):
+        state = self.files.get(file_path)
+
+        # A new file can get the inode of the deleted one, the first line still differs as it holds its first run
+        if state is None or state["inode"] != identity["inode"] or state.get("fingerprint") != identity["fingerprint"]:
+            return 0
+
+        # Smaller than what was read, the file was replaced or truncated
+        if size < state["offset"]:
+            return 0
+
+        return state["offset"]
+
+    def forget_missing_files(self, file_paths):
+        file_paths = set(file_paths)
+        self.files = {x: y for x, y in self.files.items() if x in file_paths}
+
+    def get_segment(self, name):
+        return self.segments.get(name, 0)
+
+    def begin(self, first_ids, files=None, segments=None):
+        # first_ids: table -> first ID the step inserts
+        self.pending = {"first_ids": first_ids, "files": files or {}, "segments": segments or {}}
+        self.save()
+
+    def commit(self):
+        self.files.update(self.pending["files"])
+        self.segments.update(self.pending["segments"])
+        self.pending = None
+        self.save()
+
+    def recover(self, db):
+        if self.pending is None:
+            return
+
+        found = [db.contains_value(table, "id", first_id) for table, first_id in self.pending["first_ids"].items()]
+
+        # The tables of a step are written in one transaction, so they are either all there or none is
+        if len(found) == 0 or all(found):
+            print("[DB] Confirm ingest step interrupted after its commit")
+            self.commit()
+        elif not any(found):
+            print("[DB] Repeat ingest step interrupted before its commit")
+            self.pending = None
+            self.save()
+        else:
+            ErrorHandler.handle("DB", "Interrupted ingest step was committed partially: "
+                                + json.dumps(self.pending["first_ids"]), None)
+
+
+def file_fingerprint(file_path, length=4096):
+    # Hash of the first line, at most length bytes. Appending to a file keeps it, unlike its mtime.
+    with open(file_path, "rb") as in_file:
+        first_line = in_file.readline(length)
+
+    return hashlib.sha1(first_line).hexdigest()
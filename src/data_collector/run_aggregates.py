@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from listeners.downsampling import NS_PER_HOUR
+
+
+class RunAggregates:
+    # Streaming count/sum/min/max/energy of the power per run. Samples are added in chunks while they are
+    # assigned to runs, so the samples themselves don't have to be kept until the end of the ingest.
+    AGGREGATES = ["count", "mean", "min", "max", "energy"]  # energy in Wh
+
+    def __init__(self):
+        # run -> [count, sum, min, max, energy]
+        self.runs = {}
+
+        # (run, channel) -> (timestamp, power) of the last sample, so energy continues into the next chunk
+        self.previous = {}
+
+    def add(self, runs, channel, timestamps, power):
+        # runs, timestamps and power of one channel in time order, runs < 0 are skipped
+        assigned = runs >= 0
+        runs = runs[assigned]
+        timestamps = timestamps[assigned]
+        power = power.astype(np.float64)[assigned]
+
+        if len(runs) == 0:
+            return
+
+        # Trapezoids between consecutive samples of the same run
+        energy = np.zeros(len(runs))
+        same_run = runs[1:] == runs[:-1]
+        steps = (power[1:] + power[:-1]) / 2 * (timestamps[1:] - timestamps[:-1]) / NS_PER_HOUR
+        energy[1:][same_run] = steps[same_run]
+
+        # The first sample of a run in this chunk may continue it from the previous chunk
+        starts = np.flatnonzero(np.r_[True, ~same_run])
+        for i in starts:
+            previous = self.previous.get((runs[i], channel))
+
+            if previous is not None:
+                energy[i] = (previous[1] + power[i]) / 2 * (timestamps[i] - previous[0]) / NS_PER_HOUR
+
+        ends = np.r_[starts[1:] - 1, len(runs) - 1]
+        for i in ends:
+            self.previous[(runs[i], channel)] = (timestamps[i], power[i])
+
+        grouped = pd.DataFrame({"run": runs, "power": power, "energy": energy}).groupby("run")
+        stats = grouped["power"].agg(["size", "sum", "min", "max"])
+
+        for run, count, power_sum, power_min, power_max, run_energy in zip(
+                stats.index, stats["size"], stats["sum"], stats["min"], stats["max"], grouped["energy"].sum()):
+            aggregate = self.runs.get(run)
+
+            if aggregate is None:
+                self.runs[run] = [count, power_sum, power_min, power_max, run_energy]
+                continue
+
+            aggregate[0] += count
+            aggregate[1] += power_sum
+            aggregate[2] = min(aggregate[2], power_min)
+            aggregate[3] = max(aggregate[3], power_max)
+            aggregate[4] += run_energy
+
+    def get_rows(self, aggregates):
+        # (run, *aggregates) for every run, e.g. aggregates=["mean", "energy"]
+        rows = []
+        for run, (count, power_sum, power_min, power_max, energy) in sorted(self.runs.items()):
+            values = {"count": count, "mean": power_sum / count, "min": power_min, "max": power_max,
+                      "energy": energy}
+
+            rows.append(tuple([int(run)] + [float(values[x]) for x in aggregates]))
+
+        return rows
+
+    def __len__(self):
+        return len(self.runs)
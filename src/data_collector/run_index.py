@@ -0,0 +1,42 @@
+import numpy as np
+
+from utility.utilities import datetime_to_ns
+
+
+class RunIntervalIndex:
+    # Runs of every host as sorted begin/end arrays, so samples are assigned to runs in one vectorized pass
+    # instead of a run_schedule query per sample. Runs on a host don't overlap.
+    def __init__(self, intervals):
+        by_host = {}
+        for run_id, host, begin, end in intervals:
+            by_host.setdefault(host, []).append((datetime_to_ns(begin), datetime_to_ns(end), run_id))
+
+        self.hosts = {}
+        for host, runs in by_host.items():
+            runs.sort()
+
+            self.hosts[host] = (
+                np.array([x[0] for x in runs], dtype=np.int64),
+                np.array([x[1] for x in runs], dtype=np.int64),
+                np.array([x[2] for x in runs], dtype=np.int64)
+            )
+
+    def assign(self, timestamps, host):
+        # Run id of every timestamp in ns, -1 where the host did not run anything
+        runs = np.full(len(timestamps), -1, dtype=np.int64)
+
+        if host not in self.hosts or len(timestamps) == 0:
+            return runs
+
+        begins, ends, ids = self.hosts[host]
+
+        # Last run that began at or before the sample, it contains the sample unless it already ended
+        i = np.searchsorted(begins, timestamps, side="right") - 1
+        inside = (i >= 0) & (timestamps <= ends[np.maximum(i, 0)])
+
+        runs[inside] = ids[i[inside]]
+
+        return runs
+
+    def __len__(self):
+        return sum(len(x[0]) for x in self.hosts.values())
@@ -0,0 +1,118 @@
+import argparse
+import os
+import os.path as path
+import time
+
+from database.backend import open_database
+from database.sqlite_database import SQLiteDatabase
+from error_handling.error_handler import ErrorHandler
+from settings import settings
+from utility import path_handler
+
+# Staged tables in the order they are loaded
+STAGED_TABLES = ["run_schedule", "run_eval", "measurements"]
+
+# Columns holding run_schedule IDs, they are renumbered together with the IDs on load
+RUN_REFERENCES = {"run_schedule": None, "run_eval": "run", "measurements": "run"}
+
+
+class StagingStore(SQLiteDatabase):
+    # Local SQLite file that takes the rows collect would insert into the database, so a campaign does not depend
+    # on the DB server. IDs are local and only valid within the file, load() renumbers them when the campaign is
+    # pushed to the database.
+    def __init__(self, staging_path=path_handler.staging_path):
+        super().__init__(staging_path, tables=STAGED_TABLES + ["id_allocator"])
+
+        # table -> first ID in the database of a load in progress
+        self.__execute_query__("CREATE TABLE IF NOT EXISTS bulk_load (table_name TEXT PRIMARY KEY, first_id INTEGER);")
+        self.commit()
+
+    def load(self, db):
+        # Pushes the staged rows to db in one transaction under freshly reserved IDs. The first IDs are stored
+        # before the transaction is committed, so a load that died is either confirmed or repeated, like an
+        # interrupted ingest step.
+        counts = {}
+        for table in STAGED_TABLES:
+            counts[table] = self.get_free_index(table) - 1
+
+        first_ids = dict(self.execute("SELECT table_name, first_id FROM bulk_load;"))
+
+        if len(first_ids) > 0:
+            table, first_id = next(iter(first_ids.items()))
+
+            if db.contains_value(table, "id", first_id):
+                print("[DB] Staged campaign was loaded before")
+                return counts
+
+            print("[DB] Repeat interrupted load of the staged campaign")
+
+        first_ids = dict((x, db.reserve_ids(x, y)) for x, y in counts.items() if y > 0)
+
+        self.execute("DELETE FROM bulk_load;", result_set=False)
+        self.insert_rows("bulk_load", list(first_ids.items()))
+
+        # Local IDs start at 1, so an ID moves by the first reserved one minus 1
+        offsets = dict((x, y - 1) for x, y in first_ids.items())
+
+        for table in STAGED_TABLES:
+            if counts[table] == 0:
+                continue
+
+            start_time = time.time()
+
+            columns = self.get_columns(table)
+            reference = None if RUN_REFERENCES[table] is None else columns.index(RUN_REFERENCES[table])
+
+            self.execute("SELECT {cols} FROM {tbl} ORDER BY id;".format(cols=", ".join(columns), tbl=table),
+                         result_set=False)
+
+            while True:
+                rows = self.cursor.fetchmany(settings.DATA_INSERT_BATCH_SIZE)
+                if len(rows) == 0:
+                    break
+
+                rows = [list(x) for x in rows]
+                for row in rows:
+                    row[0] += offsets[table]
+
+                    if reference is not None and row[reference] is not None:
+                        row[reference] += offsets["run_schedule"]
+
+                db.insert_rows(table, rows, fields=columns, commit=False)
+
+            print("[DB] Loaded " + str(counts[table]) + " rows into " + table + " in "
+                  + str(round(time.time() - start_time, 2)) + "s")
+
+        db.commit()
+
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a campaign staged by a dry run into the database")
+    parser.add_argument("-u", metavar="db_user", type=str, required=settings.DB_BACKEND == "mysql",
+                        help="user name to connect to the db server")
+    parser.add_argument("-p", metavar="db_password", type=str, required=settings.DB_BACKEND == "mysql",
+                        help="associated password to connect to the db server")
+    parser.add_argument("-staging", metavar="staging_path", type=str, default=path_handler.staging_path,
+                        help="staging file written by the dry run")
+    args = parser.parse_args()
+
+    if not path.exists(args.staging):
+        ErrorHandler.handle("DB", "No staging file at " + args.staging, None)
+
+    db = open_database(args.u, args.p)
+    store = StagingStore(args.staging)
+
+    start_time = time.time()
+    store.load(db)
+    store.close()
+    db.close()
+
+    # Kept next to the new staging file, so a finished campaign is not loaded again
+    os.replace(args.staging, args.staging + ".loaded")
+    print("[DB] Done in : " + str(round(time.time() - start_time, 2)) + "s")
+
+
+if __name__ == '__main__':
+    main()
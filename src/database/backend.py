@@ -0,0 +1,11 @@
+from database.mysql_database import MySQLDatabase
+from database.sqlite_database import SQLiteDatabase
+from settings import settings
+
+
+def open_database(user=None, password=None):
+    # The database of settings.DB_BACKEND, the SQLite snapshot needs no credentials
+    if settings.DB_BACKEND == "sqlite":
+        return SQLiteDatabase()
+
+    return MySQLDatabase(user, password)
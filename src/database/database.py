@@ -1,50 +1,145 @@
-import mysql.connector as mysql
-import mysql.connector.errors as mysql_err
-from datetime import datetime
-from mysql.connector import errorcode
+import abc
+import threading
+import time
+import weakref
+
 from collections.abc import Iterable
 
+import numpy as np
+import pandas as pd
+
 from error_handling.error_handler import ErrorHandler
 from settings import settings
 
 import ciso8601
 
 
-class Database:
-    def __init__(self, user, password, database=settings.DB_NAME, host=settings.DB_HOST,
-                 port=3306):
-        self.connection = None
-        self.cursor = None
+class Database(metaclass=abc.ABCMeta):
+    # Queries of the pipeline, independent of where the data is stored. Backends provide the connections and the
+    # statements that differ between database systems, see MySQLDatabase and SQLiteDatabase.
+    # Every thread uses its own connection, taken on its first query and kept, so the inserts and the commit of
+    # a transaction run on the same connection. Threads that are done with the database hand theirs back with
+    # release(), a thread that ends without doing so returns it once its thread-local state is dropped.
+    # Reads outside of a transaction are repeated on a reconnected connection if it was lost, everything else
+    # fails as before.
+    ERROR = Exception  # exception class of the driver
 
-        try:
-            print("[DB] Connect to DB on " + host)
-            self.connection = mysql.connect(
-                user=user,
-                password=password,
-                database=database,
-                host=host,
-                port=port
-            )
+    def __init__(self):
+        # Connection, cursor and whether a transaction is open, of the calling thread
+        self.local = threading.local()
+        self.slots = threading.BoundedSemaphore(settings.DB_POOL_SIZE)
 
-            self.cursor = self.connection.cursor()
+        self.run_sched_cache = {}
 
-        except mysql_err.Error as err:
-            ErrorHandler.handle("DB", "Can't connect to " + host + ":" + str(port), err, terminate=True)
+        # (table, values of the reference fields) -> ID, of rows looked up or inserted by request_ids
+        self.known_ids = {}
+        self.insert_stats = {"rows": 0, "seconds": 0.0}
 
-        self.run_sched_cache = {}
+    @abc.abstractmethod
+    def _connect(self):
+        pass
+
+    def _reconnect(self):
+        pass
+
+    def _is_connection_error(self, err):
+        return False
+
+    @abc.abstractmethod
+    def _handle_error(self, err):
+        pass
+
+    def _translate(self, statement):
+        # Statements are written with %s and %(name)s parameters, backends with other markers replace them
+        return statement
+
+    def _load_rows(self, table, rows, fields):
+        # Bulk loader of the backend for large inserts, returns False if there is none
+        return False
+
+    @abc.abstractmethod
+    def reserve_ids(self, table, count):
+        # Reserves count consecutive IDs of table and returns the first one
+        pass
+
+    @abc.abstractmethod
+    def update_rows(self, table, key_field, fields, rows, commit=True):
+        # Rows of (key, *values) are applied at once, instead of an UPDATE and a commit per row
+        pass
+
+    @property
+    def connection(self):
+        if getattr(self.local, "connection", None) is None:
+            self._borrow()
+
+        return self.local.connection
+
+    @property
+    def cursor(self):
+        if getattr(self.local, "connection", None) is None:
+            self._borrow()
+
+        return self.local.cursor
+
+    def _borrow(self):
+        # Waits while DB_POOL_SIZE connections are used by other threads
+        self.slots.acquire()
 
-    def __execute_query__(self, statement, parameter=None):
         try:
-            self.cursor.execute(statement, parameter)
-        except mysql_err.Error as err:
-            if err.errno == errorcode.ER_BAD_TABLE_ERROR:
-                ErrorHandler.handle("DB", "Bad table", err)
-            elif err.errno == errorcode.ER_BAD_FIELD_ERROR:
-                ErrorHandler.handle("DB", "Bad field", err)
-            elif err.errno == errorcode.ER_DUP_ENTRY:
-                ErrorHandler.handle("DB", "Duplicate entry", err)
-            else:
-                ErrorHandler.handle("DB", "Unhandled exception occurred", err)
+            self.local.connection = self._connect()
+        except self.ERROR:
+            self.slots.release()
+            raise
+
+        self.local.cursor = self.local.connection.cursor()
+        self.local.in_transaction = False
+
+        # Only referenced by the thread-local state, so it is collected when the thread ends
+        self.local.lease = ConnectionLease()
+        self.local.give_back = weakref.finalize(self.local.lease, give_back, self.local.connection, self.slots)
+
+    def release(self):
+        # Hands the connection of the calling thread back, uncommitted changes are rolled back
+        if getattr(self.local, "connection", None) is None:
+            return
+
+        self.local.cursor.close()
+        self.local.give_back()
+        self.local.connection = None
+
+    def __execute_query__(self, statement, parameter=None, many=False):
+        cursor = self.cursor
+        statement = self._translate(statement)
+
+        # Reads outside of a transaction do not change anything, so they can be repeated after a reconnect
+        read = statement.lstrip().upper().startswith("SELECT") and not self.local.in_transaction
+
+        for attempt in range(settings.DB_RETRIES + 1):
+            try:
+                if many:
+                    cursor.executemany(statement, parameter)
+                elif parameter is None:
+                    cursor.execute(statement)
+                else:
+                    cursor.execute(statement, parameter)
+
+                if not read:
+                    self.local.in_transaction = True
+
+                return
+            except self.ERROR as err:
+                if not self._is_connection_error(err):
+                    self._handle_error(err)
+                    return
+
+                self._reconnect()
+                cursor = self.cursor
+
+                if not read or attempt == settings.DB_RETRIES:
+                    ErrorHandler.handle("DB", "Lost the connection", err)
+                    return
+
+                print("[DB] Lost the connection, repeat the query")
 
     def contains_value(self, table, field, value, is_json_type=False):
         if is_json_type:
@@ -116,50 +211,157 @@ class Database:
             if host in self.run_sched_cache:
                 del self.run_sched_cache[host]
 
+    def get_run_intervals(self, hosts=None, begin=None, end=None):
+        # Runs of the hosts that overlap begin to end, datetimes or None for no bound
+        conditions = []
+        parameter = []
+
+        if hosts is not None:
+            if len(hosts) == 0:
+                return []
+
+            conditions.append("client_id IN (" + ", ".join(["%s"] * len(hosts)) + ")")
+            parameter.extend(hosts)
+
+        if begin is not None:
+            conditions.append("end_time >= %s")
+            parameter.append(begin)
+
+        if end is not None:
+            conditions.append("begin_time <= %s")
+            parameter.append(end)
+
+        statement = "SELECT id, client_id, begin_time, end_time FROM run_schedule"
+        if len(conditions) > 0:
+            statement += " WHERE " + " AND ".join(conditions)
+
+        self.__execute_query__(statement + ";", parameter=parameter if len(parameter) > 0 else None)
+
+        return self.cursor.fetchall()
+
     def request_id(self, table, ref_field, ref_value, values):
-        res = self.get_indices_of(table, ref_field, ref_value)
-        try:
-            id = res[0]
-        except IndexError:
-            id = self.get_free_index(table)
-            values.insert(0, id)
-            self.insert_data(table, values)
+        return self.request_ids(table, ref_field, [ref_value], [values])[0]
+
+    def request_ids(self, table, ref_fields, ref_values, values):
+        # IDs of the rows whose ref_fields hold ref_values, one per entry. The rows of values, all fields but the ID,
+        # are inserted for those that don't exist yet. Rows are looked up DB_LOOKUP_BATCH_SIZE at a time and the
+        # missing ones inserted with a single statement, IDs found before are taken from known_ids.
+        if not isinstance(ref_fields, list):
+            ref_fields = [ref_fields]
+            ref_values = [[x] for x in ref_values]
+
+        keys = [tuple(x) for x in ref_values]
+
+        unknown = list(set(x for x in keys if (table, x) not in self.known_ids))
+
+        for begin in range(0, len(unknown), settings.DB_LOOKUP_BATCH_SIZE):
+            chunk = unknown[begin:begin + settings.DB_LOOKUP_BATCH_SIZE]
+
+            if len(ref_fields) == 1:
+                condition = ref_fields[0] + " IN (" + ", ".join(["%s"] * len(chunk)) + ")"
+            else:
+                row = "(" + ", ".join(["%s"] * len(ref_fields)) + ")"
+                condition = "(" + ", ".join(ref_fields) + ") IN (" + ", ".join([row] * len(chunk)) + ")"
+
+            # The first row of a key wins if there are several
+            statement = "SELECT id, {flds} FROM {tbl} WHERE {cond} ORDER BY id DESC;".format(
+                flds=", ".join(ref_fields), tbl=table, cond=condition)
+            self.__execute_query__(statement, parameter=[x for key in chunk for x in key])
+
+            for row in self.cursor.fetchall():
+                self.known_ids[(table, tuple(row[1:]))] = row[0]
+
+        # Values of the first entry of every key not found
+        missing = {}
+        for key, row in zip(keys, values):
+            if (table, key) not in self.known_ids and key not in missing:
+                missing[key] = row
+
+        if len(missing) > 0:
+            first_id = self.reserve_ids(table, len(missing))
+
+            rows = []
+            for offset, (key, row) in enumerate(missing.items()):
+                rows.append([first_id + offset] + list(row))
+                self.known_ids[(table, key)] = first_id + offset
+
+            self.insert_rows(table, rows)
 
-        return id
+        return [self.known_ids[(table, x)] for x in keys]
 
     def insert_data(self, table, data, fields=None):
+        # data is one row or a list of rows of native values, returns the auto-increment ID of the last row
         if len(data) == 0:
             return None
 
-        if isinstance(data[0], list):
-            values = ""
-            for insertion in data:
-                values += "(\"" + ("\", \"".join(insertion)) + "\"), "
+        if not isinstance(data[0], (list, tuple)):
+            data = [data]
 
-            values = values.strip(", ")
+        self.insert_rows(table, data, fields=fields)
 
-            if fields is not None:
-                fields = ", ".join(fields)
-                statement = ("INSERT INTO {tbl} ({flds}) VALUES " + values + ";").format(tbl=table, flds=fields)
-            else:
-                statement = ("INSERT INTO {tbl} VALUES " + values + ";").format(tbl=table)
+        return self.cursor.lastrowid
+
+    def insert_rows(self, table, rows, fields=None, commit=True):
+        # Rows hold typed values, Python or NumPy, that are passed as parameters. They are sent in chunks of about
+        # settings.DB_INSERT_CHUNK_BYTES, so a batch never exceeds max_allowed_packet, and the connector turns
+        # every chunk into one multi-row insert. With commit=False several inserts are committed together by
+        # commit(). Returns the rows per second achieved.
+        # From settings.DB_LOAD_DATA_THRESHOLD rows on, the rows are handed to the bulk loader of the backend.
+        if len(rows) == 0:
+            return None
+
+        start_time = time.time()
+
+        bulk = settings.DB_LOAD_DATA_THRESHOLD is not None and len(rows) >= settings.DB_LOAD_DATA_THRESHOLD
+        if bulk and self._load_rows(table, rows, fields):
+            self.local.in_transaction = True
+
+            if commit:
+                self.commit()
+
+            return self.__count_inserted(len(rows), time.time() - start_time)
 
-            self.__execute_query__(statement)
+        values = ", ".join(["%s"] * len(rows[0]))
+
+        if fields is None:
+            statement = "INSERT INTO {tbl} VALUES ({val});".format(tbl=table, val=values)
         else:
-            values = ", ".join(["%s"] * len(data))
+            statement = "INSERT INTO {tbl} ({flds}) VALUES ({val});".format(tbl=table, flds=", ".join(fields),
+                                                                           val=values)
 
-            if fields is None:
-                statement = "INSERT INTO {tbl} VALUES ({val});".format(tbl=table, val=values)
-            else:
-                fields = ", ".join(fields)
-                statement = "INSERT INTO {tbl} ({flds}) VALUES ({val});".format(tbl=table, flds=fields, val=values)
+        # The connector only converts Python types, NumPy values are converted once their columns are known
+        numpy_columns = [i for i, x in enumerate(rows[0]) if isinstance(x, (np.generic, np.ndarray))]
 
-            self.__execute_query__(statement, parameter=data)
+        chunk_size = max(1, settings.DB_INSERT_CHUNK_BYTES // estimate_row_size(rows[0]))
+        for begin in range(0, len(rows), chunk_size):
+            chunk = rows[begin:begin + chunk_size]
 
-        self.connection.commit()
+            if len(numpy_columns) > 0:
+                chunk = [to_native_row(x, numpy_columns) for x in chunk]
+
+            self.__execute_query__(statement, parameter=chunk, many=True)
+
+        if commit:
+            self.commit()
+
+        return self.__count_inserted(len(rows), time.time() - start_time)
 
-        self.__execute_query__("SELECT LAST_INSERT_ID();")
-        return self.cursor.fetchone()[0]
+    def __count_inserted(self, rows, duration):
+        self.insert_stats["rows"] += rows
+        self.insert_stats["seconds"] += duration
+
+        return rows / max(duration, 1e-9)
+
+    def get_insert_stats(self):
+        # Rows inserted by insert_rows so far and the rows per second achieved on average
+        stats = dict(self.insert_stats)
+        stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] > 0 else None
+
+        return stats
+
+    def commit(self):
+        self.connection.commit()
+        self.local.in_transaction = False
 
     def update_data(self, table, fields, values, where_fields, where_values, conjunction="AND"):
         set = ", ".join(["{} = \"{}\""] * len(fields))
@@ -182,7 +384,7 @@ class Database:
 
         statement = ("UPDATE {tbl} SET " + set + " WHERE " + where + ";").format(tbl=table)
         self.__execute_query__(statement, parameter=None)
-        self.connection.commit()
+        self.commit()
 
     def get_data(self, table, fields=None, condition=None):
         fields_sql = "*"
@@ -216,6 +418,114 @@ class Database:
 
         return None
 
+    def iter_frames(self, sql, columns, dtypes=None, parameter=None, chunk_size=None):
+        # Streams the result of a query as DataFrames of up to settings.DB_READ_CHUNK_SIZE rows, instead of a list
+        # of all rows and a DataFrame built from it. dtypes maps columns to the dtype they get, e.g.
+        # "datetime64[ns]", "timedelta64[ns]" or "float64", the others are inferred per chunk.
+        # The cursors of the backends are unbuffered, rows are only fetched from the server as the chunks are read.
+        # The result has to be read to the end before the thread runs another query.
+        chunk_size = chunk_size or settings.DB_READ_CHUNK_SIZE
+
+        self.__execute_query__(sql, parameter=parameter)
+        cursor = self.cursor
+
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if len(rows) == 0:
+                    return
+
+                yield to_frame(rows, columns, dtypes)
+        finally:
+            # A reader that stopped early leaves rows on the connection, they are skipped so it can be used again
+            while len(cursor.fetchmany(chunk_size)) > 0:
+                pass
+
+    def iter_groups(self, sql, columns, key, dtypes=None, parameter=None, chunk_size=None):
+        # Streams (value, DataFrame) of the rows of every value of key, e.g. the measurements run by run, so only
+        # one chunk and the group it ends in are held at a time. The query has to be ORDER BY key.
+        pending = []
+        pending_key = None
+
+        for frame in self.iter_frames(sql, columns, dtypes=dtypes, parameter=parameter, chunk_size=chunk_size):
+            keys = frame[key].values
+
+            if len(pending) > 0 and keys[0] != pending_key:
+                yield pending_key, pd.concat(pending, ignore_index=True)
+                pending = []
+
+            # The group of the last key may continue in the next chunk
+            other = np.flatnonzero(keys != keys[-1])
+            tail_start = other[-1] + 1 if len(other) > 0 else 0
+
+            if tail_start > 0:
+                head = pd.concat(pending + [frame.iloc[:tail_start]], ignore_index=True)
+                pending = []
+
+                for value, group in head.groupby(key, sort=False):
+                    yield value, group
+
+            pending.append(frame.iloc[tail_start:])
+            pending_key = keys[-1]
+
+        if len(pending) > 0:
+            yield pending_key, pd.concat(pending, ignore_index=True)
+
+    def read_frame(self, sql, columns, dtypes=None, parameter=None):
+        # Whole result of a query as one DataFrame, built from the chunks of iter_frames
+        frames = list(self.iter_frames(sql, columns, dtypes=dtypes, parameter=parameter))
+
+        if len(frames) == 0:
+            return to_frame([], columns, dtypes)
+
+        return pd.concat(frames, ignore_index=True)
+
     def close(self):
-        self.cursor.close()
-        self.connection.close()
+        self.release()
+
+
+class ConnectionLease:
+    pass
+
+
+def give_back(connection, slots):
+    # Runs once per borrowed connection, on release() or after its thread ended
+    try:
+        connection.close()
+    finally:
+        slots.release()
+
+
+def estimate_row_size(row):
+    # Bytes a row takes in the statement, values are quoted and separated by ", "
+    return sum(len(str(x)) + 4 for x in row) + 2
+
+
+def to_native_row(row, columns):
+    row = list(row)
+
+    for i in columns:
+        value = row[i]
+
+        if isinstance(value, np.datetime64):
+            # Nanosecond datetimes turn into int with item(), microseconds are what MySQL stores anyway
+            row[i] = value.astype("datetime64[us]").item()
+        elif isinstance(value, (np.generic, np.ndarray)):
+            row[i] = value.item()
+
+    return row
+
+
+def to_frame(rows, columns, dtypes=None):
+    # DataFrame of rows as the connector returns them. Decimals become floats, columns in dtypes are converted.
+    frame = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+    for column, dtype in (dtypes or {}).items():
+        if dtype.startswith("datetime64"):
+            frame[column] = pd.to_datetime(frame[column])
+        elif dtype.startswith("timedelta64"):
+            frame[column] = pd.to_timedelta(frame[column])
+        else:
+            frame[column] = frame[column].astype(dtype)
+
+    return frame
@@ -0,0 +1,232 @@
+import tempfile
+import threading
+import time
+
+import mysql.connector as mysql
+import mysql.connector.errors as mysql_err
+from datetime import datetime
+from datetime import timedelta
+from mysql.connector import errorcode
+from mysql.connector import pooling
+
+import numpy as np
+
+from database.database import Database
+from database.schema import MYSQL_ADDED_COLUMNS
+from error_handling.error_handler import ErrorHandler
+from settings import settings
+
+# Local files disabled on the server (ER_NOT_ALLOWED_COMMAND, ER_CLIENT_LOCAL_FILES_DISABLED) or rejected by the
+# client (CR_LOAD_DATA_LOCAL_INFILE_REJECTED)
+LOCAL_INFILE_ERRORS = {1148, 3948, 2068}
+
+# The connection to the server is gone, the statement can be repeated on a new one
+CONNECTION_ERRORS = {errorcode.CR_SERVER_GONE_ERROR, errorcode.CR_SERVER_LOST, errorcode.CR_CONN_HOST_ERROR}
+
+
+class MySQLDatabase(Database):
+    # The database server of the campaigns. Connections of the threads are taken from a pool of DB_POOL_SIZE.
+    ERROR = mysql_err.Error
+
+    def __init__(self, user, password, database=settings.DB_NAME, host=settings.DB_HOST,
+                 port=3306):
+        super().__init__()
+
+        self.pool = None
+        self.columns = {}
+
+        # ID reservations run on a connection of their own, opened on the first reservation
+        self.connection_args = {"user": user, "password": password, "database": database, "host": host,
+                                "port": port}
+        self.id_connection = None
+        self.id_cursor = None
+        self.id_tables = set()
+        self.id_lock = threading.Lock()
+
+        try:
+            print("[DB] Connect to DB on " + host)
+            self.pool = pooling.MySQLConnectionPool(
+                pool_name="db" + str(id(self)),
+                pool_size=settings.DB_POOL_SIZE,
+                allow_local_infile=True,
+                **self.connection_args
+            )
+
+            # Borrowed right away, so an unreachable server is noticed here
+            self._borrow()
+
+        except mysql_err.Error as err:
+            ErrorHandler.handle("DB", "Can't connect to " + host + ":" + str(port), err, terminate=True)
+
+        # Cleared once the server refuses LOAD DATA LOCAL INFILE, later inserts go through insert statements
+        self.local_infile = True
+
+    def _connect(self):
+        return self.pool.get_connection()
+
+    def _reconnect(self):
+        # The statement can't be repeated without a connection, so a failed reconnect ends the process
+        try:
+            self.connection.reconnect(attempts=settings.DB_RETRIES, delay=settings.DB_RETRY_DELAY)
+            self.local.cursor = self.local.connection.cursor()
+        except mysql_err.Error as err:
+            ErrorHandler.handle("DB", "Can't reconnect", err, terminate=True)
+
+        self.local.in_transaction = False
+
+    def _is_connection_error(self, err):
+        return err.errno in CONNECTION_ERRORS
+
+    def _handle_error(self, err):
+        if err.errno == errorcode.ER_BAD_TABLE_ERROR:
+            ErrorHandler.handle("DB", "Bad table", err)
+        elif err.errno == errorcode.ER_BAD_FIELD_ERROR:
+            ErrorHandler.handle("DB", "Bad field", err)
+        elif err.errno == errorcode.ER_DUP_ENTRY:
+            ErrorHandler.handle("DB", "Duplicate entry", err)
+        else:
+            ErrorHandler.handle("DB", "Unhandled exception occurred", err)
+
+    def get_columns(self, table):
+        if table not in self.columns:
+            self.__execute_query__("SHOW COLUMNS FROM {tbl};".format(tbl=table))
+            self.columns[table] = [x[0] for x in self.cursor.fetchall()]
+
+        return self.columns[table]
+
+    def add_columns(self, table, fields, row):
+        # ALTER TABLE commits the open transaction, so columns are added before the rows needing them are inserted.
+        # Their type comes from MYSQL_ADDED_COLUMNS, not from the values in row like in SQLite.
+        for field in fields:
+            if field in self.get_columns(table):
+                continue
+
+            for prefix, column_type in MYSQL_ADDED_COLUMNS.get(table, []):
+                if field.startswith(prefix):
+                    print("[DB] Add column " + field + " to " + table)
+                    self.__execute_query__("ALTER TABLE {tbl} ADD COLUMN {fld} {type} NULL;".format(
+                        tbl=table, fld=field, type=column_type))
+                    self.columns[table].append(field)
+                    break
+
+    def reserve_ids(self, table, count):
+        # Blocks are taken from the id_allocator table with one atomic update, so collectors running side by side
+        # never get the same IDs. The update is committed right away on its own connection, independent of the
+        # transaction the IDs are inserted in.
+        if count <= 0:
+            return None
+
+        # A reservation lost with the connection only leaves a gap, so it is simply made again
+        with self.id_lock:
+            for attempt in range(settings.DB_RETRIES + 1):
+                try:
+                    return self.__reserve_ids(table, count)
+                except mysql_err.Error as err:
+                    if err.errno not in CONNECTION_ERRORS or attempt == settings.DB_RETRIES:
+                        ErrorHandler.handle("DB", "Can't reserve IDs of " + table, err, terminate=True)
+
+                    print("[DB] Lost the connection, reserve the IDs again")
+                    self.id_connection = None
+                    time.sleep(settings.DB_RETRY_DELAY)
+
+    def __reserve_ids(self, table, count):
+        if self.id_connection is None:
+            self.id_connection = mysql.connect(autocommit=True, **self.connection_args)
+            self.id_cursor = self.id_connection.cursor()
+            self.id_cursor.execute("CREATE TABLE IF NOT EXISTS id_allocator "
+                                   "(table_name VARCHAR(64) PRIMARY KEY, next_id BIGINT NOT NULL);")
+
+        # Tables filled before the allocator existed start after their highest ID
+        if table not in self.id_tables:
+            self.id_cursor.execute("INSERT IGNORE INTO id_allocator (table_name, next_id) "
+                                   "SELECT %s, COALESCE(MAX(id), 0) + 1 FROM {tbl};".format(tbl=table), (table,))
+            self.id_tables.add(table)
+
+        self.id_cursor.execute("UPDATE id_allocator SET next_id = LAST_INSERT_ID(next_id + %s) "
+                               "WHERE table_name = %s;", (count, table))
+        self.id_cursor.execute("SELECT LAST_INSERT_ID();")
+
+        return self.id_cursor.fetchone()[0] - count
+
+    def _load_rows(self, table, rows, fields):
+        # Writes the rows to a temporary TSV file and loads it with LOAD DATA LOCAL INFILE, which runs in the
+        # current transaction like an insert. LOCAL skips rows with duplicate keys instead of failing, IDs are
+        # reserved, so there are none. Returns False if the server does not allow local files.
+        if not self.local_infile:
+            return False
+
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".tsv") as tsv_file:
+            for begin in range(0, len(rows), settings.DATA_INSERT_BATCH_SIZE):
+                tsv_file.write("".join("\t".join(to_tsv_value(x) for x in row) + "\n"
+                                       for row in rows[begin:begin + settings.DATA_INSERT_BATCH_SIZE]))
+            tsv_file.flush()
+
+            statement = "LOAD DATA LOCAL INFILE %s INTO TABLE {tbl} CHARACTER SET utf8mb4 " \
+                        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'".format(tbl=table)
+            if fields is not None:
+                statement += " (" + ", ".join(fields) + ")"
+
+            try:
+                self.cursor.execute(statement + ";", (tsv_file.name,))
+            except mysql_err.Error as err:
+                if err.errno not in LOCAL_INFILE_ERRORS:
+                    ErrorHandler.handle("DB", "Can't load rows into " + table, err)
+
+                print("[DB] Server refuses LOAD DATA LOCAL INFILE, fall back to insert statements")
+                self.local_infile = False
+                return False
+
+        return True
+
+    def update_rows(self, table, key_field, fields, rows, commit=True):
+        # Rows are loaded into a temporary table and applied with a single join
+        if len(rows) == 0:
+            return
+
+        temp_table = "update_" + table
+
+        self.__execute_query__("CREATE TEMPORARY TABLE {tmp} SELECT {key}, {flds} FROM {tbl} LIMIT 0;".format(
+            tmp=temp_table, key=key_field, flds=", ".join(fields), tbl=table))
+        self.insert_rows(temp_table, rows, fields=[key_field] + fields, commit=False)
+
+        assignments = ", ".join(["t.{fld} = u.{fld}".format(fld=x) for x in fields])
+        self.__execute_query__("UPDATE {tbl} AS t JOIN {tmp} AS u ON t.{key} = u.{key} SET {set};".format(
+            tbl=table, tmp=temp_table, key=key_field, set=assignments))
+        self.__execute_query__("DROP TEMPORARY TABLE {tmp};".format(tmp=temp_table))
+
+        if commit:
+            self.commit()
+
+    def close(self):
+        super().close()
+
+        if self.id_connection is not None:
+            self.id_cursor.close()
+            self.id_connection.close()
+
+
+def to_tsv_value(value):
+    # Field of a row written for LOAD DATA, in the format MySQL reads back into the column's type
+    if value is None:
+        return "\\N"
+
+    if isinstance(value, np.datetime64):
+        value = value.astype("datetime64[us]").item()
+    elif isinstance(value, (np.generic, np.ndarray)):
+        value = value.item()
+
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    if isinstance(value, timedelta):
+        microseconds = value.days * 86400 * 10 ** 6 + value.seconds * 10 ** 6 + value.microseconds
+        seconds, microseconds = divmod(microseconds, 10 ** 6)
+        return "%d:%02d:%02d.%06d" % (seconds // 3600, seconds // 60 % 60, seconds % 60, microseconds)
+
+    if isinstance(value, bool):
+        return str(int(value))
+
+    if isinstance(value, float):
+        return "\\N" if value != value else repr(value)
+
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
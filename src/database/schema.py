@@ -0,0 +1,58 @@
+import sqlite3
+
+from datetime import timedelta
+from decimal import Decimal
+
+from settings import settings
+
+# Types the MySQL connector returns, stored so they come back the same from SQLite. Times are kept as seconds.
+sqlite3.register_adapter(timedelta, lambda x: x.total_seconds())
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_converter("INTERVAL", lambda x: timedelta(seconds=float(x)))
+
+# Tables of the database as SQLite declares them. measurements also gets a column for every component of the
+# fine-grained listeners, they are added as they show up.
+SCHEMA = {
+    "system_sw": [("id", "INTEGER PRIMARY KEY"), ("name", "TEXT")],
+    "benchmark": [("id", "INTEGER PRIMARY KEY"), ("name", "TEXT"), ("command", "TEXT")],
+    "conf_sw": [("id", "INTEGER PRIMARY KEY"), ("feature_hash", "TEXT"), ("binary_features", "TEXT"),
+                ("numeric_features", "TEXT")],
+    "run_spec": [("id", "INTEGER PRIMARY KEY"), ("hw_conf", "INTEGER"), ("sw_system", "INTEGER"),
+                 ("sw_version", "INTEGER"), ("sw_conf", "INTEGER"), ("benchmark", "INTEGER")],
+    "run_schedule": [("id", "INTEGER PRIMARY KEY"), ("run_spec", "INTEGER"), ("repetition", "INTEGER"),
+                     ("client_id", "TEXT"), ("begin_time", "TIMESTAMP"), ("end_time", "TIMESTAMP"),
+                     ("work_begin_time", "TIMESTAMP"), ("work_end_time", "TIMESTAMP"), ("peak_time", "TIMESTAMP")],
+    "run_eval": [("id", "INTEGER PRIMARY KEY"), ("run", "INTEGER"), ("status", "TEXT"),
+                 ("completion_time", "INTERVAL")] + [(x, "REAL") for x in settings.RUN_EVAL_AGGREGATES],
+    "measurements": [("id", "INTEGER PRIMARY KEY"), ("timestamp", "TIMESTAMP"), ("run", "INTEGER"),
+                     ("power_total_active", "REAL"), ("power_total_apparent", "REAL"), ("current_total", "REAL"),
+                     ("voltage_total", "REAL")],
+    "id_allocator": [("table_name", "TEXT PRIMARY KEY"), ("next_id", "INTEGER NOT NULL")]
+}
+
+# Columns of the MySQL tables that are added as listeners report them, by prefix, e.g. one per RAPL zone of the
+# benchmark node. Other columns missing there still fail as a bad field.
+MYSQL_ADDED_COLUMNS = {
+    "measurements": [("power_rapl_", "DOUBLE")]
+}
+
+# Columns the lookups and joins of the pipeline filter on
+INDEXES = {
+    "system_sw": ["name"],
+    "benchmark": ["command"],
+    "conf_sw": ["feature_hash"],
+    "run_spec": ["sw_conf"],
+    "run_schedule": ["run_spec", "client_id, begin_time"],
+    "run_eval": ["run"],
+    "measurements": ["run"]
+}
+
+
+def create_schema(cursor, tables=None):
+    for table in tables or SCHEMA:
+        cursor.execute("CREATE TABLE IF NOT EXISTS {tbl} ({cols});".format(
+            tbl=table, cols=", ".join(x[0] + " " + x[1] for x in SCHEMA[table])))
+
+        for columns in INDEXES.get(table, []):
+            cursor.execute("CREATE INDEX IF NOT EXISTS {tbl}_{name} ON {tbl} ({cols});".format(
+                tbl=table, name=columns.replace(", ", "_"), cols=columns))
@@ -0,0 +1,191 @@
+import argparse
+import os
+import os.path as path
+import re
+import sqlite3
+import time
+
+from datetime import datetime
+from datetime import timedelta
+
+import numpy as np
+
+from database.database import Database
+from database.mysql_database import MySQLDatabase
+from database.schema import SCHEMA
+from database.schema import create_schema
+from error_handling.error_handler import ErrorHandler
+from settings import settings
+from utility import path_handler
+
+PARAMETER = re.compile(r"%\((\w+)\)s|%s")
+
+
+class SQLiteDatabase(Database):
+    # Database in a local file, e.g. a snapshot of the server for offline analysis or a run without a server.
+    # The tables are created as declared in schema.SCHEMA. SQLite has a single writer, concurrent writes of
+    # several threads wait for each other.
+    ERROR = sqlite3.Error
+
+    def __init__(self, database_path=path_handler.database_snapshot_path, tables=None):
+        super().__init__()
+
+        self.path = database_path
+        self.columns = {}
+
+        try:
+            print("[DB] Open DB in " + self.path)
+            os.makedirs(path.dirname(path.abspath(self.path)), exist_ok=True)
+
+            create_schema(self.cursor, tables)
+            self.commit()
+
+        except sqlite3.Error as err:
+            ErrorHandler.handle("DB", "Can't open " + self.path, err, terminate=True)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)
+
+        # Readers don't block the writer, a crash may lose the last commits but never corrupts the file
+        connection.execute("PRAGMA journal_mode=WAL;")
+        connection.execute("PRAGMA synchronous=NORMAL;")
+
+        return connection
+
+    def _handle_error(self, err):
+        message = str(err)
+
+        if message.startswith("no such table"):
+            ErrorHandler.handle("DB", "Bad table", err)
+        elif message.startswith("no such column"):
+            ErrorHandler.handle("DB", "Bad field", err)
+        elif message.startswith("UNIQUE constraint failed"):
+            ErrorHandler.handle("DB", "Duplicate entry", err)
+        else:
+            ErrorHandler.handle("DB", "Unhandled exception occurred", err)
+
+    def _translate(self, statement):
+        return PARAMETER.sub(lambda x: "?" if x.group(1) is None else ":" + x.group(1), statement)
+
+    def get_columns(self, table):
+        if table not in self.columns:
+            self.__execute_query__("PRAGMA table_info({tbl});".format(tbl=table))
+            self.columns[table] = [x[1] for x in self.cursor.fetchall()]
+
+        return self.columns[table]
+
+    def add_columns(self, table, fields, row):
+        # Columns not declared in the schema, e.g. the components of fine-grained listeners, are added on first use
+        for field, value in zip(fields, row):
+            if field not in self.get_columns(table):
+                self.__execute_query__("ALTER TABLE {tbl} ADD COLUMN {fld} {type};".format(
+                    tbl=table, fld=field, type=column_type(value)))
+                self.columns[table].append(field)
+
+    def insert_rows(self, table, rows, fields=None, commit=True):
+        if fields is not None and len(rows) > 0:
+            self.add_columns(table, fields, rows[0])
+
+        return super().insert_rows(table, rows, fields=fields, commit=commit)
+
+    def reserve_ids(self, table, count):
+        # Reserved in the transaction of the caller, a second connection would wait for its write lock
+        if count <= 0:
+            return None
+
+        self.__execute_query__("INSERT OR IGNORE INTO id_allocator (table_name, next_id) "
+                               "SELECT %s, COALESCE(MAX(id), 0) + 1 FROM {tbl};".format(tbl=table), (table,))
+        self.__execute_query__("UPDATE id_allocator SET next_id = next_id + %s WHERE table_name = %s;",
+                               (count, table))
+        self.__execute_query__("SELECT next_id FROM id_allocator WHERE table_name = %s;", (table,))
+
+        return self.cursor.fetchone()[0] - count
+
+    def update_rows(self, table, key_field, fields, rows, commit=True):
+        # Updates by primary key or index are cheap in a local file, no temporary table is needed
+        if len(rows) == 0:
+            return
+
+        statement = "UPDATE {tbl} SET {set} WHERE {key} = %s;".format(
+            tbl=table, set=", ".join(x + " = %s" for x in fields), key=key_field)
+        self.__execute_query__(statement, parameter=[tuple(x[1:]) + (x[0],) for x in rows], many=True)
+
+        if commit:
+            self.commit()
+
+
+def column_type(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+
+    if isinstance(value, datetime):
+        return "TIMESTAMP"
+
+    if isinstance(value, timedelta):
+        return "INTERVAL"
+
+    if isinstance(value, (bool, int)):
+        return "INTEGER"
+
+    if isinstance(value, float):
+        return "REAL"
+
+    return "TEXT"
+
+
+def create_snapshot(source, snapshot_path, tables=None):
+    # Copies the tables of the schema from source into a new SQLite file, which replaces snapshot_path once it is
+    # complete. Columns of the server missing in the schema are taken over as well.
+    if path.exists(snapshot_path + ".tmp"):
+        os.remove(snapshot_path + ".tmp")
+
+    snapshot = SQLiteDatabase(snapshot_path + ".tmp")
+
+    for table in tables or [x for x in SCHEMA if x != "id_allocator"]:
+        start_time = time.time()
+        rows = 0
+
+        source.execute("SELECT * FROM {tbl};".format(tbl=table), result_set=False)
+        columns = [x[0] for x in source.cursor.description]
+
+        while True:
+            chunk = source.cursor.fetchmany(settings.DATA_INSERT_BATCH_SIZE)
+            if len(chunk) == 0:
+                break
+
+            snapshot.insert_rows(table, chunk, fields=columns, commit=False)
+            rows += len(chunk)
+
+        snapshot.commit()
+        print("[DB] Copied " + str(rows) + " rows of " + table + " in "
+              + str(round(time.time() - start_time, 2)) + "s")
+
+    snapshot.close()
+
+    for suffix in ["-wal", "-shm"]:
+        if path.exists(snapshot_path + suffix):
+            os.remove(snapshot_path + suffix)
+
+    os.replace(snapshot_path + ".tmp", snapshot_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the database server into a local SQLite snapshot")
+    parser.add_argument("-u", metavar="db_user", type=str, required=True, help="user name to connect to the db server")
+    parser.add_argument("-p", metavar="db_password", type=str, required=True, help="associated password to connect to "
+                                                                                   "the db server")
+    parser.add_argument("-output", metavar="snapshot_path", type=str, default=path_handler.database_snapshot_path,
+                        help="SQLite file to write, used with DB_BACKEND = \"sqlite\"")
+    parser.add_argument("-tables", metavar="table", type=str, nargs="+", default=None, help="tables to copy")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    source = MySQLDatabase(args.u, args.p)
+    create_snapshot(source, args.output, args.tables)
+    source.close()
+
+    print("[DB] Done in : " + str(round(time.time() - start_time, 2)) + "s")
+
+
+if __name__ == '__main__':
+    main()
@@ -46,19 +46,22 @@ class Plotter:
     def plot_energy_performance_tradeoff(self, sched_ids, plot_id, metric="energy"):
         plt.figure(plot_id)
 
-        results = self.db.execute("SELECT s.id, e.completion_time, m.power_total_active, m.power_total_apparent," +
-                                  " m.timestamp, s.work_begin_time, s.work_end_time" +
-                                  " FROM run_schedule as s" +
-                                  " JOIN run_eval AS e ON e.run = s.id"
-                                  " JOIN measurements AS m ON m.run = s.id" +
-                                  " WHERE s.id IN (" + (",".join(str(x) for x in sched_ids)) + ");")
-
-        results = pandas.DataFrame.from_records(results,
-                                                columns=["id", "completion_time", "active_power", "apparent_power",
-                                                         "timestamp", "work_begin", "work_end"])
+        results = self.db.iter_groups("SELECT s.id, e.completion_time, m.power_total_active, m.power_total_apparent," +
+                                      " m.timestamp, s.work_begin_time, s.work_end_time" +
+                                      " FROM run_schedule as s" +
+                                      " JOIN run_eval AS e ON e.run = s.id"
+                                      " JOIN measurements AS m ON m.run = s.id" +
+                                      " WHERE s.id IN (" + (",".join(str(x) for x in sched_ids)) + ")" +
+                                      " ORDER BY s.id, m.timestamp;",
+                                      ["id", "completion_time", "active_power", "apparent_power", "timestamp",
+                                       "work_begin", "work_end"],
+                                      "id",
+                                      dtypes={"completion_time": "timedelta64[ns]", "active_power": "float64",
+                                              "apparent_power": "float64", "timestamp": "datetime64[ns]",
+                                              "work_begin": "datetime64[ns]", "work_end": "datetime64[ns]"})
 
         plot_data = []
-        for group in results.groupby("id"):
+        for group in results:
             rep_measurements = group[1]
             rep_measurements = rep_measurements[rep_measurements["timestamp"] >= rep_measurements.iloc[0]["work_begin"]]
             rep_measurements = rep_measurements[rep_measurements["timestamp"] <= rep_measurements.iloc[0]["work_end"]]
@@ -123,13 +126,14 @@ class Plotter:
         # plt.show()
 
     def plot_power_curve(self, run_id):
-        results = self.db.execute(
+        df = self.db.read_frame(
             "SELECT timestamp, power_total_active, power_total_apparent, current_total, voltage_total, work_begin_time, work_end_time, peak_time FROM measurements AS m " +
-            "JOIN run_schedule as s ON s.id = m.run WHERE run = " + str(run_id) + ";")
-
-        df = pandas.DataFrame.from_records(results,
-                                           columns=["timestamp", "active_power", "apparent_power", "current", "voltage",
-                                                    "work_begin_time", "work_end_time", "peak_time"])
+            "JOIN run_schedule as s ON s.id = m.run WHERE run = " + str(run_id) + " ORDER BY timestamp;",
+            ["timestamp", "active_power", "apparent_power", "current", "voltage", "work_begin_time", "work_end_time",
+             "peak_time"],
+            dtypes={"timestamp": "datetime64[ns]", "active_power": "float64", "apparent_power": "float64",
+                    "current": "float64", "voltage": "float64", "work_begin_time": "datetime64[ns]",
+                    "work_end_time": "datetime64[ns]", "peak_time": "datetime64[ns]"})
 
         peak_indices, _ = find_peaks(df["apparent_power"])
         peak_start_index = 0
@@ -176,18 +180,17 @@ class Plotter:
         # plt.show()
 
     def plot_config_variance(self, sched_ids):
-        measurements = self.db.execute(
+        measurements = self.db.iter_groups(
             "SELECT s.id, timestamp, power_total_active, power_total_apparent, work_begin_time, work_end_time, spec.sw_conf FROM measurements AS m " +
             "JOIN run_schedule as s ON s.id = m.run JOIN run_spec as spec ON spec.id = s.run_spec " +
-            "WHERE run IN (" + ", ".join(str(x) for x in sched_ids) + ");"
-        )
-
-        measurements = pandas.DataFrame.from_records(measurements,
-                                                     columns=["id", "timestamp", "active_power", "apparent_power",
-                                                              "work_begin", "work_end", "conf_id"])
+            "WHERE run IN (" + ", ".join(str(x) for x in sched_ids) + ") ORDER BY s.id, timestamp;",
+            ["id", "timestamp", "active_power", "apparent_power", "work_begin", "work_end", "conf_id"],
+            "id",
+            dtypes={"timestamp": "datetime64[ns]", "active_power": "float64", "apparent_power": "float64",
+                    "work_begin": "datetime64[ns]", "work_end": "datetime64[ns]"})
 
         configs = []
-        for group in measurements.groupby("id"):
+        for group in measurements:
             rep_measurements = group[1]
             rep_measurements = rep_measurements[rep_measurements["timestamp"] >= rep_measurements.iloc[0]["work_begin"]]
             rep_measurements = rep_measurements[rep_measurements["timestamp"] <= rep_measurements.iloc[0]["work_end"]]
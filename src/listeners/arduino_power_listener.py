@@ -1,25 +1,40 @@
+from listeners.downsampling import DownsamplingStage
+from listeners.downsampling import read_tier
 from listeners.listener import Listener
-
+from listeners.sample_buffer import COMPONENT_FIELDS
+from listeners.sample_buffer import SampleBuffer
+from listeners.sample_buffer import read_samples
+from settings import settings
+from utility import path_handler
+from utility.utilities import now_ns
+from utility.utilities import ns_to_datetime
+
+import numpy as np
+import pandas as pd
 import serial
+import selectors
 import time
-import datetime
-from itertools import islice
 
 
 class ArduinoPowerListener(Listener):
+    METRICS = ["power"]
+    SEGMENT_FIELDS = COMPONENT_FIELDS
 
-    def __init__(self):
+    def __init__(self, ports=None, baudrate=1000000, resolutions=settings.DOWNSAMPLING_RESOLUTIONS):
         super().__init__()
 
-        self.ports = ["/dev/ttyUSB0", "/dev/ttyUSB1"]
-        self.arduinos = [serial.Serial(port, baudrate=1000000) for port in self.ports]
-
-        self.read_start_times = [None for _ in self.arduinos]
-        self.out_path = "../data/buffer/arduino_power.csv"  # TODO: Change to actual path
+        if ports is None:
+            ports = ["/dev/ttyUSB0", "/dev/ttyUSB1"]
 
-        self.out_file = open(self.out_path, mode="w+")
+        self.ports = ports
+        self.baudrate = baudrate
+        self.read_timeout = 0.1  # seconds, bounds how long stop/pause wait for a silent port
 
-        self.is_writing = False
+        self.arduinos = []
+        self.pending = []
+        self.last_read = []
+        self.selector = None
+        self.out_buffer = None
 
         self.constants = \
             {
@@ -53,63 +68,127 @@ class ArduinoPowerListener(Listener):
                 "F": "power_mobo_12v_2"
             }
 
+        # Components are stored as codes into this list and loaded as categoricals
+        self.components = list(self.constants)
+
+        # Frame prefix -> (component, component code, scale), so a frame is decoded with a single lookup
+        self.frame_table = {
+            component.encode(): (component, code, self.constants[component])
+            for code, component in enumerate(self.components)
+        }
+
+        self.channel_counts = {component: 0 for component in self.constants}
+        self.channel_counts_since = time.time()
+
         self.assembled_host = "tesla002"
 
+        self.init_segments(path_handler.buffer_root, "arduino_power", ".smpl")
+
+        if resolutions is not None and len(resolutions) > 0:
+            self.add_stage(DownsamplingStage(self.METRICS, resolutions))
+
+    def open(self):
+        self.__open_ports()
+
+        super().open()
+
     def start(self):
         super().start()
 
         time.sleep(1.464975)  # measured time for initial read from port
 
-    def stop(self):
-        super().stop()
+    def __open_segment__(self, segment_path):
+        self.out_buffer = SampleBuffer(segment_path, COMPONENT_FIELDS, capacity=settings.ARDUINO_BUFFER_CAPACITY,
+                                       max_capacity=settings.ARDUINO_BUFFER_MAX_CAPACITY)
 
-        while self.thread.is_alive():
-            pass
+    def __close_segment__(self):
+        self.out_buffer.close()
 
-        self.read_start_times = []
-        for arduino in self.arduinos:
-            arduino.close()
-            self.read_start_times.append(None)
+    def __open_ports(self):
+        self.arduinos = [serial.Serial(port, baudrate=self.baudrate, timeout=0) for port in self.ports]
+        self.pending = [b"" for _ in self.arduinos]
+        self.last_read = [now_ns() for _ in self.arduinos]
 
-        self.out_file.flush()
-        self.out_file.close()
-        self.out_file = None
+        # All ports are served by one thread, a port is only read once it has data
+        self.selector = selectors.DefaultSelector()
+        for i, arduino in enumerate(self.arduinos):
+            self.selector.register(arduino.fileno(), selectors.EVENT_READ, data=i)
 
-    def pause(self):
-        super().pause()
+    def __close_ports(self):
+        # Ports are closed on pause as well, so they may be closed already
+        if self.selector is None:
+            return
 
-        while self.is_writing:
-            pass
+        self.selector.close()
+        self.selector = None
 
-        self.read_start_times = []
         for arduino in self.arduinos:
             arduino.close()
-            self.read_start_times.append(None)
 
-        self.out_file.flush()
-        self.out_file.close()
-        self.out_file = None
+    def close(self):
+        super().close()
+
+        self.__close_ports()
+
+    def pause(self):
+        super().pause()
+
+        self.__close_ports()
 
     def resume(self):
-        self.out_file = open(self.out_path, mode="w+")
-        self.arduinos = [serial.Serial(port, baudrate=1000000) for port in self.ports]
+        self.__open_ports()
 
         super().resume()
 
-    def get_data(self):
-        with open(self.out_path) as in_file:
-            strptime = datetime.datetime.strptime
+    def get_channel_rates(self):
+        with self.state_changed:
+            now = time.time()
+            duration = now - self.channel_counts_since
 
-            for line in in_file:
-                attribs = line.replace("\n", "").split(",")
+            rates = {}
+            for component, count in self.channel_counts.items():
+                rates[self.component_tanslate[component]] = count / duration if duration > 0 else 0
+                self.channel_counts[component] = 0
 
-                try:
-                    # timestamp = np.datetime64(attribs[1])
-                    timestamp = strptime(attribs[1], "%Y-%m-%d %H:%M:%S.%f")
-                    # timestamp = None
-                    yield {"component": attribs[0], "timestamp": timestamp, "power": float(attribs[2])}
-                except ValueError as err:
-                    yield None
+            self.channel_counts_since = now
+
+        return rates
+
+    def iter_chunks(self, segments=None, chunk_size=settings.ARDUINO_CHUNK_SIZE, resolution=None):
+        if segments is None:
+            segments = self.sealed_segments()
+
+        components = pd.CategoricalDtype(self.components)
+
+        # Windows are reported with their mean power
+        component, power = ("component", "power") if resolution is None else ("channel", "power_mean")
+
+        # Segments are memory-mapped, only the slice of the current chunk is materialized
+        for segment in segments:
+            if resolution is None:
+                records = read_samples(segment, COMPONENT_FIELDS)
+            else:
+                records = read_tier(segment, self.METRICS, resolution)
+
+                if records is None:
+                    continue
+
+            for start in range(0, len(records), chunk_size):
+                chunk = records[start:start + chunk_size]
+
+                yield pd.DataFrame({
+                    "timestamp": np.array(chunk["timestamp"]),
+                    "component": pd.Categorical.from_codes(chunk[component], dtype=components),
+                    "power": np.array(chunk[power])
+                })
+
+    def get_data(self, segments=None):
+        for chunk in self.iter_chunks(segments):
+            for timestamp, component, power in zip(chunk["timestamp"].tolist(), chunk["component"], chunk["power"]):
+                yield {"component": component, "timestamp": ns_to_datetime(timestamp), "power": float(power)}
+
+    def get_components(self):
+        return list(self.component_tanslate)
 
     def translate_component_to_table(self, component):
         if component in self.component_tanslate:
@@ -118,54 +197,53 @@ class ArduinoPowerListener(Listener):
         return None
 
     def __listen__(self):
-        self.is_writing = True
-
-        for i in range(0, len(self.arduinos)):
-            if self.read_start_times[i] is None:
-                self.read_start_times[i] = datetime.datetime.now()
+        ready = self.selector.select(timeout=self.read_timeout)
+        timestamp = now_ns()
 
-            data = self.arduinos[i].readline()
-            timestamp = datetime.datetime.now()
-            result = self.__extract_data(data)
+        for key, _ in ready:
+            i = key.data
+            arduino = self.arduinos[i]
 
-            power = 0
+            # Drain everything the port has buffered, frames are split in one go afterwards
+            frames = (self.pending[i] + arduino.read(max(1, arduino.in_waiting))).split(b"\n")
+            self.pending[i] = frames.pop()
 
-            if result is not None:
-                component, power = result
+            # The frames arrived since the previous read of the port, their times are spread evenly over it
+            last_read = self.last_read[i]
+            step = (timestamp - last_read) / max(1, len(frames))
 
-                try:
-                    if component in self.constants:
-                        power = self.constants[component] * float(power)
-                        # timestamp = self.read_start_times[i] + delta_time
+            records = []
+            counts = {}
+            for n, frame in enumerate(frames, 1):
+                attribs = frame.rstrip(b"\r").split(b",")
 
-                        if power <= 65000:
-                            self.out_file.write(component + "," + str(timestamp) + "," + str(power) + "\n")
-                except ValueError:
-                    pass
+                if len(attribs) != 2 or attribs[0] not in self.frame_table:
+                    continue
 
-        self.is_writing = False
+                component, code, scale = self.frame_table[attribs[0]]
 
-    @staticmethod
-    def __extract_data(data):
-        if data is not None:
-            in_string = None
-            try:
-                in_string = data.decode("utf-8")
+                try:
+                    power = scale * float(attribs[1])
+                except ValueError:
+                    continue
 
-            except UnicodeDecodeError:
-                pass
+                if power <= 65000:
+                    records.append((last_read + int(step * n), code, power))
+                    counts[component] = counts.get(component, 0) + 1
 
-            if in_string is not None:
-                attribs = in_string.replace("\n", "").split(",")
+            self.out_buffer.append_many(records)
 
-                if len(attribs) == 2:
-                    component = attribs[0]
-                    # delta_time = attribs[1]
-                    power = attribs[1]
+            # get_channel_rates reads and resets the counts under the lock
+            with self.state_changed:
+                for component, count in counts.items():
+                    self.channel_counts[component] += count
 
-                    # delta_time = datetime.timedelta(microseconds=float(delta_time))
+            if len(self.stages) > 0:
+                for frame_time, code, power in records:
+                    self.publish(frame_time, code, (power,))
 
-                    return component, power
+        # A port without data had none up to now
+        self.last_read = [timestamp for _ in self.arduinos]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,120 @@
+import os.path as path
+
+from listeners.sample_buffer import SampleBuffer
+from listeners.sample_buffer import read_samples
+from listeners.stage import Stage
+from settings import settings
+
+NS_PER_HOUR = 3600 * 1e9
+
+
+def create_tier_fields(metrics):
+    fields = [("timestamp", "q"), ("channel", "i"), ("count", "I")]
+
+    for metric in metrics:
+        fields.extend([(metric + "_mean", "f"), (metric + "_min", "f"), (metric + "_max", "f")])
+
+    # Trapezoidal energy of the first metric, which has to be a power in W
+    fields.append(("energy", "f"))  # Wh
+
+    return fields
+
+
+class DownsamplingStage(Stage):
+    def __init__(self, metrics, resolutions=settings.DOWNSAMPLING_RESOLUTIONS):
+        self.metrics = metrics
+        self.resolutions = resolutions
+        self.fields = create_tier_fields(metrics)
+
+        self.buffers = [None for _ in resolutions]
+
+        # Per tier: channel -> [window, count, sums, mins, maxs, energy]
+        self.windows = [{} for _ in resolutions]
+
+        # channel -> (timestamp, power) of the previous sample for the energy integration
+        self.previous = {}
+
+    def files(self, segment_path):
+        return [tier_path(segment_path, x) for x in self.resolutions]
+
+    def open(self, segment_path):
+        # Open windows are carried over and written to the new segment once they are complete
+        for i, resolution in enumerate(self.resolutions):
+            if self.buffers[i] is not None:
+                self.buffers[i].close()
+
+            self.buffers[i] = SampleBuffer(tier_path(segment_path, resolution), self.fields)
+
+    def close(self):
+        for i in range(len(self.resolutions)):
+            for channel, window in self.windows[i].items():
+                self.__write_window(i, channel, window)
+
+            self.windows[i] = {}
+
+            if self.buffers[i] is not None:
+                self.buffers[i].close()
+                self.buffers[i] = None
+
+    def push(self, timestamp, channel, values):
+        power = values[0]
+        gap = None
+        energy = 0
+
+        if channel in self.previous:
+            previous_time, previous_power = self.previous[channel]
+            gap = timestamp - previous_time
+            energy = (previous_power + power) / 2 * (gap / NS_PER_HOUR)
+
+        self.previous[channel] = (timestamp, power)
+
+        for i, resolution in enumerate(self.resolutions):
+            resolution_ns = int(resolution * 1e9)
+            window_idx = timestamp // resolution_ns
+            window = self.windows[i].get(channel)
+
+            if window is not None and window[0] != window_idx:
+                self.__write_window(i, channel, window)
+                window = None
+
+            # Energy between two samples is booked to the window of the later one, unless there is a gap
+            window_energy = energy if gap is not None and gap <= resolution_ns else 0
+
+            if window is None:
+                self.windows[i][channel] = [window_idx, 1, list(values), list(values), list(values), window_energy]
+                continue
+
+            window[1] += 1
+            window[5] += window_energy
+            sums, mins, maxs = window[2], window[3], window[4]
+
+            for j, value in enumerate(values):
+                sums[j] += value
+
+                if value < mins[j]:
+                    mins[j] = value
+
+                if value > maxs[j]:
+                    maxs[j] = value
+
+    def __write_window(self, tier, channel, window):
+        window_idx, count, sums, mins, maxs, energy = window
+        record = [int(window_idx * self.resolutions[tier] * 1e9), channel, count]
+
+        for j in range(len(self.metrics)):
+            record.extend([sums[j] / count, mins[j], maxs[j]])
+
+        record.append(energy)
+
+        self.buffers[tier].append(*record)
+
+
+def tier_path(segment_path, resolution):
+    return segment_path + "." + str(resolution) + "s"
+
+
+def read_tier(segment_path, metrics, resolution):
+    if not path.exists(tier_path(segment_path, resolution)):
+        return None
+
+    return read_samples(tier_path(segment_path, resolution), create_tier_fields(metrics))
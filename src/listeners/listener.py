@@ -1,16 +1,162 @@
 import abc
+import os
+import os.path as path
+import re
 import threading
-import time
+
+from listeners.sample_buffer import read_samples
+from listeners.sample_scheduler import SampleScheduler
 
 
 class Listener(metaclass=abc.ABCMeta):
-    def __init__(self):
+    # Record layout of the segments
+    SEGMENT_FIELDS = None
+
+    def __init__(self, sample_rate=None, catch_up=SampleScheduler.SKIP):
         self.is_paused = False
-        self.thread = ListeningThread(self)
         self.is_listening = False
+        self.is_writing = False
+        self.is_sealing = False
+
+        # Whether the resources of the sampling side, e.g. ports and the current segment, are open
+        self.is_open = False
+
+        # Guards is_paused/is_listening/is_writing/is_sealing. The listening thread waits on it while paused and
+        # control calls wait on it until the sample in flight has been flushed, so nothing spins.
+        self.state_changed = threading.Condition()
+
+        # Listeners without a sample rate are driven by their source, e.g. a blocking serial read
+        self.scheduler = None
+        if sample_rate is not None:
+            self.scheduler = SampleScheduler(sample_rate, catch_up=catch_up)
+
+        self.segment_dir = None
+        self.segment_name = None
+        self.segment_extension = None
+        self.segment_seq = None
+        self.segment_seq_path = None
+
+        self.stages = []
+
+        self.thread = ListeningThread(self)
+
+    def init_segments(self, segment_dir, name, extension):
+        os.makedirs(segment_dir, exist_ok=True)
+
+        self.segment_dir = segment_dir
+        self.segment_name = name
+        self.segment_extension = extension
+
+        # Segments left over from an earlier run have not been ingested yet, so continue after them. The last
+        # sequence number is kept as well, so numbers are never reused and the ingest checkpoint can refer to them.
+        segments = self.list_segments()
+        last_seq = segments[-1][0] if len(segments) > 0 else 0
+
+        self.segment_seq_path = path.join(segment_dir, name + ".seq")
+        if path.exists(self.segment_seq_path):
+            with open(self.segment_seq_path) as seq_file:
+                last_seq = max(last_seq, int(seq_file.read()))
+
+        self.segment_seq = last_seq + 1
+        self.__store_segment_seq()
+
+    def __store_segment_seq(self):
+        with open(self.segment_seq_path, "w") as seq_file:
+            seq_file.write(str(self.segment_seq))
+
+    def segment_path(self, seq):
+        return path.join(self.segment_dir, self.segment_name + "." + str(seq).zfill(6) + self.segment_extension)
+
+    def list_segments(self):
+        pattern = re.compile(re.escape(self.segment_name) + r"\.(\d+)" + re.escape(self.segment_extension) + "$")
+
+        segments = []
+        for filename in os.listdir(self.segment_dir):
+            match = pattern.match(filename)
+
+            if match is not None:
+                segments.append((int(match.group(1)), path.join(self.segment_dir, filename)))
+
+        return sorted(segments)
+
+    def sealed_segments(self):
+        return [x[1] for x in self.list_segments() if x[0] < self.segment_seq]
+
+    def seal_segment(self):
+        # Swap the segment in between two samples. Sampling goes on in the next segment right away while
+        # the sealed ones are ingested.
+        with self.state_changed:
+            # Keeps a free-running listener from grabbing the lock again before the swap
+            self.is_sealing = True
+            self.state_changed.wait_for(lambda: not self.is_writing)
+
+            if self.is_open:
+                self.__close_segment__()
+
+            self.segment_seq += 1
+            self.__store_segment_seq()
+
+            if self.is_open:
+                self.__open_segment__(self.segment_path(self.segment_seq))
+
+                for stage in self.stages:
+                    stage.open(self.segment_path(self.segment_seq))
+
+            self.is_sealing = False
+            self.state_changed.notify_all()
+
+        return self.sealed_segments()
+
+    def discard_segments(self, segments):
+        for segment in segments:
+            files = [segment]
+            for stage in self.stages:
+                files.extend(stage.files(segment))
+
+            for file in files:
+                if path.exists(file):
+                    os.remove(file)
+
+    def add_stage(self, stage):
+        if self.is_open:
+            stage.open(self.segment_path(self.segment_seq))
+
+        self.stages.append(stage)
+
+    def publish(self, timestamp, channel, values):
+        for stage in self.stages:
+            stage.push(timestamp, channel, values)
+
+    def __open_segment__(self, segment_path):
+        pass
+
+    def __close_segment__(self):
+        pass
+
+    def open(self):
+        # Opens what sampling needs, listeners add their ports, sessions or counters. Called by start, so a
+        # listener hosted by a ProcessListener only holds them in its sampling process.
+        if self.segment_seq is not None:
+            self.__open_segment__(self.segment_path(self.segment_seq))
+
+            for stage in self.stages:
+                stage.open(self.segment_path(self.segment_seq))
+
+        self.is_open = True
+
+    def close(self):
+        # Counterpart of open(), called by stop once the listening thread ended
+        if self.segment_seq is not None:
+            self.__close_segment__()
+
+        self.is_open = False
 
     def start(self):
-        self.is_listening = True
+        self.open()
+
+        with self.state_changed:
+            self.is_listening = True
+
         self.thread.start()
 
     @abc.abstractmethod
@@ -18,16 +164,86 @@ class Listener(metaclass=abc.ABCMeta):
         pass
 
     def pause(self):
-        self.is_paused = True
+        with self.state_changed:
+            self.is_paused = True
+            self.state_changed.notify_all()
+
+        self.wait_for_flush()
 
     def resume(self):
-        self.is_paused = False
+        with self.state_changed:
+            if self.scheduler is not None:
+                self.scheduler.restart()
+
+            self.is_paused = False
+            self.state_changed.notify_all()
 
     def stop(self):
-        self.is_listening = False
+        with self.state_changed:
+            self.is_listening = False
+            self.state_changed.notify_all()
+
+        if self.thread.is_alive() and threading.current_thread() is not self.thread:
+            self.thread.join()
+
+        for stage in self.stages:
+            stage.close()
+
+        # A listener that was never started has nothing to close
+        if self.is_open:
+            self.close()
+
+    def wait_for_flush(self, timeout=None):
+        with self.state_changed:
+            return self.state_changed.wait_for(lambda: not self.is_writing, timeout)
+
+    def begin_sample(self):
+        with self.state_changed:
+            while True:
+                self.state_changed.wait_for(
+                    lambda: (not self.is_paused and not self.is_sealing) or not self.is_listening)
+
+                if not self.is_listening:
+                    return False
+
+                if self.scheduler is None:
+                    break
+
+                delay = self.scheduler.next_delay()
+
+                # Sleep until the next deadline unless a pause or stop comes in first
+                if delay <= 0 or not self.state_changed.wait_for(
+                        lambda: self.is_paused or not self.is_listening, delay):
+                    self.scheduler.record()
+                    break
+
+            self.is_writing = True
+            return True
+
+    def get_timing_stats(self):
+        if self.scheduler is None:
+            return None
+
+        with self.state_changed:
+            return self.scheduler.get_stats()
+
+    def end_sample(self):
+        with self.state_changed:
+            self.is_writing = False
+            self.state_changed.notify_all()
+
+    def get_time_span(self, segments):
+        # First and last timestamp in ns of the segments, None if they hold no samples
+        timestamps = [read_samples(x, self.SEGMENT_FIELDS)["timestamp"] for x in segments]
+        timestamps = [x for x in timestamps if len(x) > 0]
+
+        if len(timestamps) == 0:
+            return None
+
+        return int(min(x.min() for x in timestamps)), int(max(x.max() for x in timestamps))
 
     @abc.abstractmethod
-    def get_data(self):
+    def get_data(self, segments=None):
         pass
 
 
@@ -37,7 +253,8 @@ class ListeningThread(threading.Thread):
         self.listener = listener
 
     def run(self):
-        while self.listener.is_listening:
-            while self.listener.is_paused:
-                pass
-            self.listener.__listen__()
+        while self.listener.begin_sample():
+            try:
+                self.listener.__listen__()
+            finally:
+                self.listener.end_sample()
@@ -0,0 +1,201 @@
+import json
+import os
+import os.path as path
+import socket
+import socketserver
+import threading
+
+import numpy as np
+
+from listeners.downsampling import NS_PER_HOUR
+from listeners.stage import Stage
+from utility.utilities import now_ns
+
+
+class RecentSamplesStage(Stage):
+    # Keeps the most recent samples of every channel in memory. The first metric has to be a power in W,
+    # its running energy is kept next to the samples, so energy since T is a lookup instead of an integration.
+    def __init__(self, metrics, capacity):
+        self.metrics = metrics
+        self.capacity = capacity
+
+        # push runs in the listening thread, queries in the server threads
+        self.lock = threading.Lock()
+
+        # channel -> {timestamps, values, energy, count}
+        self.channels = {}
+
+    def push(self, timestamp, channel, values):
+        with self.lock:
+            ring = self.channels.get(channel)
+
+            if ring is None:
+                ring = {
+                    "timestamps": np.zeros(self.capacity, dtype=np.int64),
+                    "values": np.zeros((self.capacity, len(self.metrics))),
+                    "energy": np.zeros(self.capacity),  # Wh since the first sample
+                    "count": 0
+                }
+                self.channels[channel] = ring
+
+            count = ring["count"]
+            i = count % self.capacity
+            energy = 0
+
+            if count > 0:
+                previous = (count - 1) % self.capacity
+                gap = timestamp - ring["timestamps"][previous]
+                energy = ring["energy"][previous] + (ring["values"][previous, 0] + values[0]) / 2 * (gap / NS_PER_HOUR)
+
+            ring["timestamps"][i] = timestamp
+            ring["values"][i] = values
+            ring["energy"][i] = energy
+            ring["count"] = count + 1
+
+    def get_channels(self):
+        with self.lock:
+            return sorted(self.channels)
+
+    def __snapshot(self, channel):
+        # Copies of the retained samples in order, taken under the lock so a concurrent push can't tear them
+        with self.lock:
+            ring = self.channels.get(channel)
+
+            if ring is None or ring["count"] == 0:
+                return None
+
+            count = ring["count"]
+
+            if count <= self.capacity:
+                return ring["timestamps"][:count].copy(), ring["values"][:count].copy(), ring["energy"][:count].copy()
+
+            start = count % self.capacity
+            order = np.r_[start:self.capacity, 0:start]
+
+            return ring["timestamps"][order], ring["values"][order], ring["energy"][order]
+
+    def latest(self, channel):
+        with self.lock:
+            ring = self.channels.get(channel)
+
+            if ring is None or ring["count"] == 0:
+                return None
+
+            i = (ring["count"] - 1) % self.capacity
+
+            return int(ring["timestamps"][i]), ring["values"][i].tolist()
+
+    def mean(self, channel, since):
+        snapshot = self.__snapshot(channel)
+
+        if snapshot is None:
+            return None
+
+        timestamps, values, _ = snapshot
+        start = int(np.searchsorted(timestamps, since))
+
+        if start == len(timestamps):
+            return None
+
+        return int(timestamps[start]), len(timestamps) - start, values[start:].mean(axis=0).tolist()
+
+    def energy(self, channel, since):
+        snapshot = self.__snapshot(channel)
+
+        if snapshot is None:
+            return None
+
+        timestamps, _, energy = snapshot
+
+        # Starts at the oldest retained sample if T is older, the caller gets the actual start back
+        start = min(int(np.searchsorted(timestamps, since)), len(timestamps) - 1)
+
+        return int(timestamps[start]), int(timestamps[-1]), float(energy[-1] - energy[start])
+
+
+class LiveQueryHandler(socketserver.StreamRequestHandler):
+    # One JSON request per line, answered with one JSON line. Connections stay open for further requests.
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.answer(json.loads(line.decode()))
+            except (ValueError, KeyError, TypeError) as err:
+                response = {"error": str(err)}
+
+            self.wfile.write((json.dumps(response) + "\n").encode())
+
+
+class LiveQueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, stage, get_names):
+        # A socket left behind by a killed daemon would block the bind
+        if path.exists(socket_path):
+            os.remove(socket_path)
+
+        super().__init__(socket_path, LiveQueryHandler)
+
+        self.socket_path = socket_path
+        self.stage = stage
+        self.get_names = get_names
+
+    def server_close(self):
+        super().server_close()
+
+        if path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def __resolve(self, request):
+        names = self.get_names()
+        channels = self.stage.get_channels()
+
+        if request.get("outlet") is None:
+            return [(x, names[x]) for x in channels]
+
+        if request["outlet"] not in names:
+            raise KeyError("Unknown outlet " + str(request["outlet"]))
+
+        channel = names.index(request["outlet"])
+
+        return [(channel, request["outlet"])] if channel in channels else []
+
+    def answer(self, request):
+        query = request["query"]
+        metrics = self.stage.metrics
+        result = {}
+
+        if query == "outlets":
+            return {"outlets": [x[1] for x in self.__resolve({})]}
+
+        if query not in ("latest", "mean", "energy"):
+            raise ValueError("Unknown query " + str(query))
+
+        for channel, name in self.__resolve(request):
+            if query == "latest":
+                sample = self.stage.latest(channel)
+
+                if sample is not None:
+                    result[name] = {"timestamp": sample[0] / 1e9, "values": dict(zip(metrics, sample[1]))}
+            elif query == "mean":
+                window = self.stage.mean(channel, now_ns() - int(float(request["window"]) * 1e9))
+
+                if window is not None:
+                    result[name] = {"since": window[0] / 1e9, "samples": window[1],
+                                    "values": dict(zip(metrics, window[2]))}
+            elif query == "energy":
+                energy = self.stage.energy(channel, int(float(request["since"]) * 1e9))
+
+                if energy is not None:
+                    result[name] = {"since": energy[0] / 1e9, "until": energy[1] / 1e9, "energy": energy[2]}
+
+        return {query: result}
+
+
+def query(socket_path, request):
+    # Single request for tools that don't keep a connection open
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall((json.dumps(request) + "\n").encode())
+
+        with client.makefile("rb") as response:
+            return json.loads(response.readline().decode())
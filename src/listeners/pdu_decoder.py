@@ -0,0 +1,165 @@
+import array
+import re
+
+LOCAL_PARAMETER = [
+    "outlet.name.dev1",
+    "outlet.current.dev1",
+    "outlet.voltage.dev1",
+    "outlet.apppower.dev1",
+    "outlet.power.dev1",
+    "outlet.pf.dev1",
+    "outlet.energy.dev1",
+    "noexport.state.dev1"
+]
+
+GLOBAL_PARAMETER = ["sys.time"]
+
+NAME_TAG = "outlet.name.dev1"
+
+FIELD_NAMES = {
+    "outlet.current.dev1": "current",
+    "outlet.voltage.dev1": "voltage",
+    "outlet.apppower.dev1": "power-apparent",
+    "outlet.power.dev1": "power-active",
+    "outlet.pf.dev1": "power_factor",
+    "outlet.energy.dev1": "energy"
+}
+
+# get_param.cgi answers with a flat list of <tag>value</tag> elements. Outlet values follow their
+# outlet.name element in request order, so a single precompiled pattern is enough to tokenize it.
+ELEMENT_PATTERN = re.compile(rb"<(outlet\.[a-z]+\.dev1)>([^<]*)</")
+
+
+class PDUResponseDecoder:
+    def __init__(self, local_parameter, outlets):
+        self.outlets = list(outlets)
+        self.columns = [FIELD_NAMES[x] for x in local_parameter if x in FIELD_NAMES]
+        self.width = len(self.columns)
+
+        # Tag -> column in an outlet's slice of the row, -1 marks the start of the next outlet
+        self.dispatch = {NAME_TAG.encode(): -1}
+        for i, tag in enumerate([x for x in local_parameter if x in FIELD_NAMES]):
+            self.dispatch[tag.encode()] = i
+
+        self.empty_row = array.array("d", [float("nan")] * (len(self.outlets) * self.width))
+        self.row = array.array("d", self.empty_row)
+        self.names = [None] * len(self.outlets)
+
+        self.outlet = -1
+        self.tail = b""
+
+    def reset(self):
+        self.row[:] = self.empty_row
+        self.outlet = -1
+        self.tail = b""
+
+    def feed(self, chunk):
+        buffer = self.tail + chunk if len(self.tail) > 0 else chunk
+
+        # Everything up to the last closing tag holds complete elements, the rest waits for the next chunk
+        end = buffer.rfind(b"</") + 2
+        self.tail = buffer[end:] if end > 1 else buffer
+
+        dispatch = self.dispatch
+        names = self.names
+        row = self.row
+        width = self.width
+        outlet = self.outlet
+        offset = outlet * width
+
+        for tag, value in ELEMENT_PATTERN.findall(buffer, 0, end):
+            # Tags of parameters that were not requested are skipped
+            column = dispatch.get(tag)
+
+            if column is None:
+                continue
+
+            if column < 0:
+                outlet += 1
+                offset = outlet * width
+
+                if outlet >= len(names):
+                    break
+
+                names[outlet] = value.decode()
+            elif outlet >= 0:
+                try:
+                    row[offset + column] = float(value)
+                except ValueError:
+                    pass
+
+        self.outlet = outlet
+
+    def decode(self, content):
+        self.reset()
+        self.feed(content)
+
+        return self.decoded_outlets()
+
+    def decoded_outlets(self):
+        return min(self.outlet + 1, len(self.names))
+
+
+def create_sample_response(local_parameter, outlets):
+    lines = ["<?xml version=\"1.0\" encoding=\"UTF-8\"?>", "<response>", "<sys.time>1556704800</sys.time>"]
+
+    for outlet in outlets:
+        for tag in local_parameter:
+            if tag == NAME_TAG:
+                value = "tesla" + str(outlet).zfill(3)
+            elif tag in FIELD_NAMES:
+                value = str(round(40 + outlet * 1.5, 3))
+            else:
+                value = "1"
+
+            lines.append("<" + tag + ">" + value + "</" + tag + ">")
+
+    lines.append("</response>")
+
+    return "\n".join(lines).encode()
+
+
+def main():
+    import timeit
+    import xml.etree.ElementTree as ET
+
+    local_parameter = LOCAL_PARAMETER
+    outlets = range(9, 18)
+    content = create_sample_response(local_parameter, outlets)
+    decoder = PDUResponseDecoder(local_parameter, outlets)
+
+    def element_tree():
+        tree = ET.fromstring(content.decode())
+
+        data = {}
+        current_outlet = None
+        for element in tree.iter():
+            if element.tag == "outlet.name.dev1":
+                data[element.text] = {}
+                current_outlet = element.text
+            elif element.tag == "outlet.current.dev1":
+                data[current_outlet]["current"] = float(element.text)
+            elif element.tag == "outlet.voltage.dev1":
+                data[current_outlet]["voltage"] = float(element.text)
+            elif element.tag == "outlet.power.dev1":
+                data[current_outlet]["power-active"] = float(element.text)
+            elif element.tag == "outlet.apppower.dev1":
+                data[current_outlet]["power-apparent"] = float(element.text)
+            elif element.tag == "outlet.pf.dev1":
+                data[current_outlet]["power_factor"] = float(element.text)
+            elif element.tag == "outlet.energy.dev1":
+                data[current_outlet]["energy"] = float(element.text)
+
+        return data
+
+    def precompiled():
+        return decoder.decode(content)
+
+    runs = 5000
+    for name, func in [("ElementTree if/elif", element_tree), ("Precompiled decoder", precompiled)]:
+        duration = min(timeit.repeat(func, number=runs, repeat=5)) / runs
+        print("[PDU] " + name + ": " + str(round(duration * 1e6, 2)) + "us per response")
+
+
+if __name__ == '__main__':
+    main()
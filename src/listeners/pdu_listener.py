@@ -1,148 +1,260 @@
+import asyncio
+import concurrent.futures
 import datetime
 import itertools
 import json
-import os
 import os.path as path
 import time
-import xml.etree.ElementTree as ET
 
+import numpy as np
+import pandas as pd
 import requests
+import requests.adapters
 
+from error_handling.error_handler import ErrorHandler
+from listeners import pdu_decoder
+from listeners.downsampling import DownsamplingStage
+from listeners.downsampling import create_tier_fields
+from listeners.downsampling import read_tier
 from listeners.listener import Listener
+from listeners.pdu_decoder import PDUResponseDecoder
+from listeners.sample_buffer import POWER_FIELDS
+from listeners.sample_buffer import SampleBuffer
+from listeners.sample_buffer import create_dtype
+from listeners.sample_buffer import read_samples
+from settings import settings
 from utility import path_handler
+from utility.utilities import now_ns
 
 
 class PDUListener(Listener):
-    def __init__(self, outlets=range(9, 18), sample_rate=4):
-        super().__init__()
+    METRICS = ["power_active", "power_apparent", "current", "voltage"]
+    SEGMENT_FIELDS = POWER_FIELDS
 
-        self.pdu_address = "http://pdu001.medien.uni-weimar.de/cgi/get_param.cgi"
+    def __init__(self, outlets=range(9, 18), sample_rate=4, pdus=None, outlets_per_request=None,
+                 resolutions=settings.DOWNSAMPLING_RESOLUTIONS):
+        super().__init__(sample_rate=sample_rate)
 
-        local_parameter = [
-            "outlet.name.dev1",
-            "outlet.current.dev1",
-            "outlet.voltage.dev1",
-            "outlet.apppower.dev1",
-            "outlet.power.dev1",
-            "outlet.pf.dev1",
-            "outlet.energy.dev1",
-            "noexport.state.dev1"
-        ]
+        # Maps PDU host -> outlets to poll on it
+        if pdus is None:
+            pdus = {settings.PDU_HOST: outlets}
 
-        global_parameter = ["sys.time"]
+        self.pdus = pdus
+        self.outlets = list(itertools.chain.from_iterable(pdus.values()))
 
+        self.local_parameter = pdu_decoder.LOCAL_PARAMETER
+        self.global_parameter = pdu_decoder.GLOBAL_PARAMETER
+
+        # One poll target per PDU and outlet range. Every target keeps its own session, so the
+        # keep-alive connection is reused across ticks and targets can be polled concurrently. Sessions are
+        # created by open().
+        self.targets = []
+        offset = 0
+        for host, pdu_outlets in pdus.items():
+            pdu_outlets = list(pdu_outlets)
+            chunk_size = len(pdu_outlets) if outlets_per_request is None else outlets_per_request
+
+            for i in range(0, len(pdu_outlets), chunk_size):
+                self.targets.append({
+                    "url": self.__create_url(host, pdu_outlets[i:i + chunk_size]),
+                    "session": None,
+                    "decoder": PDUResponseDecoder(self.local_parameter, pdu_outlets[i:i + chunk_size]),
+                    "offset": offset
+                })
+
+                offset += len(pdu_outlets[i:i + chunk_size])
+
+        columns = self.targets[0]["decoder"].columns
+        self.record_columns = [columns.index(x) for x in ["power-active", "power-apparent", "current", "voltage"]]
+
+        # Records reference outlets by index, the names reported by the PDUs are kept next to the buffer
+        self.outlet_names = [None] * len(self.outlets)
+
+        self.request_timeout = settings.PDU_REQUEST_TIMEOUT
+        self.executor = None
+        self.event_loop = None
+
+        self.names_path = path.join(path_handler.buffer_root, "pdu.outlets.json")
+        self.out_buffer = None
+
+        self.init_segments(path_handler.buffer_root, "pdu", ".smpl")
+
+        if resolutions is not None and len(resolutions) > 0:
+            self.add_stage(DownsamplingStage(PDUListener.METRICS, resolutions))
+
+    def __create_url(self, host, outlets):
         outlet_ids = itertools.chain.from_iterable(
-            itertools.repeat(x, len(local_parameter)) for x in outlets)
+            itertools.repeat(x, len(self.local_parameter)) for x in outlets)
 
-        self.param_string = "&".join([x + "[{}]" for x in local_parameter] * len(outlets)).format(*outlet_ids)
-        self.param_string = "&".join(global_parameter) + "&" + self.param_string
-        self.param_string = "?xml&" + self.param_string
+        param_string = "&".join([x + "[{}]" for x in self.local_parameter] * len(outlets)).format(*outlet_ids)
+        param_string = "&".join(self.global_parameter) + "&" + param_string
+        param_string = "?xml&" + param_string
 
-        self.outlets = outlets
-        self.sample_interval = 1 / sample_rate
-        self.process_time = float("inf")
-        self.out_path = path_handler.buffer_root
+        if not host.startswith("http"):
+            host = "http://" + host
 
-        if not os.path.exists(self.out_path):
-            os.makedirs(self.out_path)
+        return host + "/cgi/get_param.cgi" + param_string
 
-        self.out_path = path.join(self.out_path, "pdu.jsonld")
-        self.out_file = open(self.out_path, "w+")
+    def open(self):
+        for target in self.targets:
+            target["session"] = self.__create_session()
 
-        self.is_writing = False
+        super().open()
+
+    @staticmethod
+    def __create_session():
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
+    def __request(self, target):
+        decoder = target["decoder"]
+        decoder.reset()
 
-    def __listen__(self):
-        self.is_writing = True
-        if self.process_time < self.sample_interval:
-            time.sleep(self.sample_interval - self.process_time)
-
-        start = time.time()
-        response = requests.get(self.pdu_address + self.param_string)
-
-        tree = ET.fromstring(response.text)
-
-        data = {}
-        current_outlet = None
-        for element in tree.iter():
-            if element.tag == "outlet.name.dev1":
-                data[element.text] = {}
-                current_outlet = element.text
-            elif element.tag == "outlet.current.dev1":
-                data[current_outlet]["current"] = float(element.text)
-            elif element.tag == "outlet.voltage.dev1":
-                data[current_outlet]["voltage"] = float(element.text)
-            elif element.tag == "outlet.power.dev1":
-                data[current_outlet]["power-active"] = float(element.text)
-            elif element.tag == "outlet.apppower.dev1":
-                data[current_outlet]["power-apparent"] = float(element.text)
-            elif element.tag == "outlet.pf.dev1":
-                data[current_outlet]["power_factor"] = float(element.text)
-            elif element.tag == "outlet.energy.dev1":
-                data[current_outlet]["energy"] = float(element.text)
-            elif element.tag == "sys.time":
-                data["time"] = datetime.datetime.now().isoformat()
-            elif element.tag == "sys.passwd":
-                pass
-
-        self.write_data(data)
-        self.process_time = (time.time() - start)
-        self.is_writing = False
-
-    def write_data(self, data):
         try:
-            self.out_file.write(json.dumps(data, default=str) + "\n")
-        except ValueError:
-            pass
+            with target["session"].get(target["url"], timeout=self.request_timeout, stream=True) as response:
+                response.raise_for_status()
+
+                for chunk in response.iter_content(chunk_size=None):
+                    decoder.feed(chunk)
+        except requests.RequestException as err:
+            ErrorHandler.handle("PDU", "Can't poll " + target["url"].split("?")[0], err, terminate=False)
+            decoder.reset()
+
+    async def __request_all(self):
+        return await asyncio.gather(
+            *[self.event_loop.run_in_executor(self.executor, self.__request, target) for target in self.targets])
+
+    def __poll(self):
+        if len(self.targets) == 1:
+            return self.__request(self.targets[0])
+
+        # The event loop lives in the listening thread, so it is created on the first tick
+        if self.event_loop is None:
+            self.event_loop = asyncio.new_event_loop()
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.targets))
+
+        return self.event_loop.run_until_complete(self.__request_all())
+
+    def __listen__(self):
+        self.__poll()
+        self.write_data(now_ns())
+
+    def write_data(self, timestamp):
+        names_changed = False
+        power_active, power_apparent, current, voltage = self.record_columns
+
+        for target in self.targets:
+            decoder = target["decoder"]
+            row = decoder.row
+
+            for i in range(decoder.decoded_outlets()):
+                outlet = target["offset"] + i
+                base = i * decoder.width
+
+                if self.outlet_names[outlet] != decoder.names[i]:
+                    self.outlet_names[outlet] = decoder.names[i]
+                    names_changed = True
+
+                values = (row[base + power_active], row[base + power_apparent], row[base + current],
+                          row[base + voltage])
+
+                self.out_buffer.append(timestamp, outlet, *values)
+                self.publish(timestamp, outlet, values)
+
+        if names_changed:
+            with open(self.names_path, "w") as names_file:
+                json.dump(self.outlet_names, names_file)
+
+    def get_outlet_names(self):
+        with open(self.names_path) as names_file:
+            return json.load(names_file)
+
+    def get_arrays(self, segments=None, resolution=None):
+        if segments is None:
+            segments = self.sealed_segments()
+
+        if resolution is None:
+            fields = POWER_FIELDS
+            records = [read_samples(segment, fields) for segment in segments]
+        else:
+            fields = create_tier_fields(PDUListener.METRICS)
+            records = [read_tier(segment, PDUListener.METRICS, resolution) for segment in segments]
+            records = [x for x in records if x is not None]
+
+        if len(records) == 0:
+            return np.empty(0, dtype=create_dtype(fields))
+        elif len(records) == 1:
+            return records[0]
+
+        return np.concatenate(records)
+
+    def get_frame(self, segments=None, resolution=None):
+        records = self.get_arrays(segments, resolution)
+
+        if resolution is None:
+            outlets = records["outlet"]
+            columns = PDUListener.METRICS
+        else:
+            # Windows are reported with the mean of each metric
+            outlets = records["channel"]
+            columns = [x + "_mean" for x in PDUListener.METRICS]
+
+        names = np.array(self.get_outlet_names() if len(records) > 0 else [], dtype=object)
 
-    def get_data(self):
-        with open(self.out_path, "r") as self.out_file:
-            for line in self.out_file:
-                data = json.loads(line)
-                timestamp = ""
+        frame = pd.DataFrame({
+            "timestamp": np.array(records["timestamp"]),
+            "outlet": names[outlets]
+        })
 
-                for key in data:
-                    if key == "time":
-                        timestamp = data[key]
-                    else:
-                        yield (
-                            timestamp,
-                            key,
-                            data[key]["power-active"],
-                            data[key]["power-apparent"],
-                            data[key]["current"],
-                            data[key]["voltage"]
-                        )
+        for metric, column in zip(PDUListener.METRICS, columns):
+            frame[metric] = np.array(records[column])
 
-    def stop(self):
-        super().stop()
+        return frame
 
-        while self.is_writing:
-            pass
+    def get_data(self, segments=None, resolution=None):
+        frame = self.get_frame(segments, resolution)
 
-        self.out_file.close()
+        for timestamp, outlet, power_active, power_apparent, current, voltage in zip(
+                frame["timestamp"].tolist(), frame["outlet"], *[frame[x].tolist() for x in PDUListener.METRICS]):
+            yield (
+                datetime.datetime.fromtimestamp(timestamp / 1e9).isoformat(),
+                outlet,
+                power_active,
+                power_apparent,
+                current,
+                voltage
+            )
 
-    def pause(self):
-        super().pause()
+    def __open_segment__(self, segment_path):
+        self.out_buffer = SampleBuffer(segment_path, POWER_FIELDS)
 
-        while self.is_writing:
-            pass
+    def __close_segment__(self):
+        self.out_buffer.close()
 
-        self.out_file.flush()
-        self.out_file.close()
+    def close(self):
+        super().close()
 
-    def resume(self):
-        self.out_file = open(self.out_path, "w+")
+        for target in self.targets:
+            target["session"].close()
+            target["session"] = None
 
-        super().resume()
+        if self.event_loop is not None:
+            self.event_loop.close()
+            self.executor.shutdown()
+            self.event_loop = None
 
 
 def main():
     listener = PDUListener()
     listener.start()
     time.sleep(2)
-    listener.pause()
-    listener.get_data()
-    listener.resume()
+    segments = listener.seal_segment()
+    listener.get_data(segments)
+    listener.discard_segments(segments)
     time.sleep(2)
     listener.stop()
 
@@ -0,0 +1,174 @@
+import multiprocessing
+import threading
+
+from listeners.sample_channel import ChannelStage
+from listeners.sample_channel import SampleChannel
+
+
+class ProcessListener:
+    # Hosts a listener in its own process, so sampling does not compete for the GIL with the orchestrator.
+    # The sampling process builds its own listener from listener_class and config. Control calls are sent over
+    # a pipe. If stages were added here, samples come back through a shared-memory SampleChannel and are handed
+    # to them, without stages there is no channel. Stages of the listener itself, e.g. downsampling, keep running
+    # next to it in the sampling process. Data is read from the segment files by the listener object in this
+    # process, which never opens ports, sessions or segments itself.
+    REMOTE_METHODS = ["get_timing_stats", "get_channel_rates"]
+
+    def __init__(self, listener_class, relay_interval=0.05, **config):
+        self.listener_class = listener_class
+        self.config = config
+        self.listener = listener_class(**config)
+        self.relay_interval = relay_interval
+
+        self.channel = None
+        self.stages = []
+
+        self.control = None
+        self.control_lock = threading.Lock()
+        self.process = None
+
+        self.relay = None
+        self.relay_stopped = threading.Event()
+
+    def __getattr__(self, name):
+        # Only called for attributes missing here. State that changes while sampling lives in the sampling
+        # process, everything else is taken from the listener object in this process.
+        if name == "listener":
+            raise AttributeError(name)
+
+        if name in ProcessListener.REMOTE_METHODS:
+            return lambda *args: self.__call("call", name, args)
+
+        return getattr(self.listener, name)
+
+    def add_stage(self, stage):
+        # The channel is set up on start for the stages known by then
+        if self.process is not None:
+            raise RuntimeError("Stages of " + self.listener.__class__.__name__ + " are added before it starts")
+
+        self.stages.append(stage)
+
+    def start(self):
+        # Mapped by the sampling process through its path
+        if len(self.stages) > 0:
+            self.channel = SampleChannel(len(self.listener.METRICS))
+
+        # Started by a forkserver, a fork of this process would copy the locks its listener, relay and database
+        # threads hold at that moment
+        context = multiprocessing.get_context("forkserver")
+        self.control, child_control = context.Pipe()
+
+        channel_path = None if self.channel is None else self.channel.path
+        self.process = context.Process(target=serve_listener, daemon=True,
+                                       args=(self.listener_class, self.config, channel_path, child_control))
+        self.process.start()
+        child_control.close()
+
+        # The sampling process numbers the segments of its listener, the one here follows it
+        self.listener.segment_seq = self.__call("start")
+
+        if self.channel is not None:
+            for stage in self.stages:
+                stage.open(self.listener.segment_path(self.listener.segment_seq))
+
+            self.relay = threading.Thread(target=self.__relay_samples, daemon=True)
+            self.relay.start()
+
+    def pause(self):
+        self.__call("pause")
+
+    def resume(self):
+        self.__call("resume")
+
+    def seal_segment(self):
+        self.listener.segment_seq = self.__call("seal")
+
+        for stage in self.stages:
+            stage.open(self.listener.segment_path(self.listener.segment_seq))
+
+        return self.listener.sealed_segments()
+
+    def stop(self):
+        if self.process is not None:
+            self.__call("stop")
+            self.process.join()
+            self.control.close()
+            self.process = None
+
+        if self.relay is not None:
+            self.relay_stopped.set()
+            self.relay.join()
+            self.relay = None
+
+        if self.channel is not None:
+            for stage in self.stages:
+                stage.close()
+
+            dropped = self.channel.get_dropped()
+            if dropped > 0:
+                print("[" + self.listener.__class__.__name__ + "] " + str(dropped)
+                      + " samples were dropped on the way from the sampling process")
+
+            self.channel.close()
+            self.channel = None
+
+    def __call(self, command, *args):
+        with self.control_lock:
+            self.control.send((command,) + args)
+            ok, result = self.control.recv()
+
+        if not ok:
+            raise RuntimeError(self.listener.__class__.__name__ + " failed in its sampling process: " + result)
+
+        return result
+
+    def __relay_samples(self):
+        while True:
+            stopped = self.relay_stopped.wait(self.relay_interval)
+
+            for record in self.channel.get().tolist():
+                for stage in self.stages:
+                    stage.push(record[0], record[1], record[2:])
+
+            if stopped:
+                break
+
+
+def serve_listener(listener_class, config, channel_path, control):
+    # Runs in the sampling process
+    listener = listener_class(**config)
+
+    channel = None
+    if channel_path is not None:
+        channel = SampleChannel(len(listener.METRICS), path=channel_path)
+        listener.add_stage(ChannelStage(channel))
+
+    while True:
+        message = control.recv()
+        command = message[0]
+
+        try:
+            if command == "start":
+                listener.start()
+                result = listener.segment_seq
+            elif command == "pause":
+                result = listener.pause()
+            elif command == "resume":
+                result = listener.resume()
+            elif command == "seal":
+                listener.seal_segment()
+                result = listener.segment_seq
+            elif command == "stop":
+                result = listener.stop()
+            else:
+                result = getattr(listener, message[1])(*message[2])
+
+            control.send((True, result))
+        except Exception as err:
+            control.send((False, repr(err)))
+
+        if command == "stop":
+            break
+
+    if channel is not None:
+        channel.close()
@@ -0,0 +1,265 @@
+import json
+import os
+import os.path as path
+import re
+import socket
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from error_handling.error_handler import ErrorHandler
+from listeners.downsampling import DownsamplingStage
+from listeners.downsampling import read_tier
+from listeners.listener import Listener
+from listeners.sample_buffer import COMPONENT_FIELDS
+from listeners.sample_buffer import SampleBuffer
+from listeners.sample_buffer import read_samples
+from settings import settings
+from utility import path_handler
+from utility.utilities import now_ns
+from utility.utilities import ns_to_datetime
+
+# Top level zones are packages (or psys), zones with a second index are their subzones (core, uncore, dram).
+# intel-rapl-mmio zones report the same package counters again and are left out.
+ZONE_PATTERN = re.compile(r"intel-rapl:(\d+)(?::(\d+))?$")
+
+
+class RAPLListener(Listener):
+    METRICS = ["power"]
+    SEGMENT_FIELDS = COMPONENT_FIELDS
+
+    def __init__(self, powercap_root=settings.POWERCAP_ROOT, sample_rate=settings.RAPL_SAMPLE_RATE, host=None,
+                 resolutions=settings.DOWNSAMPLING_RESOLUTIONS):
+        super().__init__(sample_rate=sample_rate)
+
+        if host is None:
+            host = socket.gethostname().split(".")[0]
+
+        self.powercap_root = powercap_root
+        self.host = host
+
+        # Per zone: component name, path of energy_uj, its file descriptor while open and the counter range
+        self.components = []
+        self.energy_paths = []
+        self.energy_files = []
+        self.max_ranges = []
+
+        self.last_energy = None
+        self.last_timestamp = None
+
+        self.out_buffer = None
+
+        self.__find_zones()
+        self.init_segments(path_handler.buffer_root, "rapl", ".smpl")
+
+        # Records reference zones by index, the names are kept next to the buffer
+        self.components_path = path.join(path_handler.buffer_root, "rapl.components.json")
+        with open(self.components_path, "w") as components_file:
+            json.dump(self.components, components_file)
+
+        if resolutions is not None and len(resolutions) > 0:
+            self.add_stage(DownsamplingStage(self.METRICS, resolutions))
+
+    def __find_zones(self):
+        zones = []
+        try:
+            for filename in os.listdir(self.powercap_root):
+                match = ZONE_PATTERN.match(filename)
+
+                if match is not None:
+                    zones.append((int(match.group(1)), int(match.group(2) or -1), filename))
+
+            if len(zones) == 0:
+                raise IOError
+        except IOError as err:
+            ErrorHandler.handle("RAPL", "No RAPL zones found in " + self.powercap_root, err)
+
+        names = {}
+        for package, subzone, filename in sorted(zones):
+            zone_dir = path.join(self.powercap_root, filename)
+
+            with open(path.join(zone_dir, "name")) as name_file:
+                name = name_file.read().strip()
+
+            with open(path.join(zone_dir, "max_energy_range_uj")) as range_file:
+                max_range = int(range_file.read())
+
+            # Subzones are named after their package, e.g. package-0/dram
+            if subzone >= 0:
+                name = names[package] + "/" + name
+            else:
+                names[package] = name
+
+            self.components.append(name)
+            self.energy_paths.append(path.join(zone_dir, "energy_uj"))
+            self.max_ranges.append(max_range)
+
+    def __open_zones(self):
+        for name, energy_path in zip(self.components, self.energy_paths):
+            try:
+                self.energy_files.append(os.open(energy_path, os.O_RDONLY))
+            except OSError as err:
+                ErrorHandler.handle("RAPL", "Can't open energy counter of " + name, err)
+
+    def __close_zones(self):
+        for energy_file in self.energy_files:
+            os.close(energy_file)
+
+        self.energy_files = []
+
+    def __read_energy(self):
+        # The counters stay open, a sample costs one pread per zone
+        return [int(os.pread(x, 32, 0)) for x in self.energy_files]
+
+    def open(self):
+        self.__open_zones()
+
+        super().open()
+
+    def __open_segment__(self, segment_path):
+        self.out_buffer = SampleBuffer(segment_path, COMPONENT_FIELDS)
+
+    def __close_segment__(self):
+        self.out_buffer.close()
+
+    def close(self):
+        super().close()
+
+        self.__close_zones()
+
+    def resume(self):
+        # Power is averaged between two reads, so the first read after a pause only sets the baseline
+        self.last_energy = None
+
+        super().resume()
+
+    def __listen__(self):
+        energy = self.__read_energy()
+        timestamp = now_ns()
+
+        if self.last_energy is not None:
+            duration = timestamp - self.last_timestamp
+
+            if duration > 0:
+                records = []
+                for code, (current, last) in enumerate(zip(energy, self.last_energy)):
+                    delta = current - last
+
+                    # The counter restarts at zero once it passed max_energy_range_uj, it wraps at that value + 1
+                    if delta < 0:
+                        delta += self.max_ranges[code] + 1
+
+                    # uJ / ns = 1000 W
+                    records.append((timestamp, code, delta * 1000 / duration))
+
+                self.out_buffer.append_many(records)
+
+                if len(self.stages) > 0:
+                    for _, code, power in records:
+                        self.publish(timestamp, code, (power,))
+
+        self.last_energy = energy
+        self.last_timestamp = timestamp
+
+    def get_components(self):
+        with open(self.components_path) as components_file:
+            return json.load(components_file)
+
+    def iter_chunks(self, segments=None, chunk_size=settings.ARDUINO_CHUNK_SIZE, resolution=None):
+        if segments is None:
+            segments = self.sealed_segments()
+
+        components = pd.CategoricalDtype(self.get_components())
+        component, power = ("component", "power") if resolution is None else ("channel", "power_mean")
+
+        for segment in segments:
+            if resolution is None:
+                records = read_samples(segment, COMPONENT_FIELDS)
+            else:
+                records = read_tier(segment, self.METRICS, resolution)
+
+                if records is None:
+                    continue
+
+            for start in range(0, len(records), chunk_size):
+                chunk = records[start:start + chunk_size]
+
+                yield pd.DataFrame({
+                    "timestamp": np.array(chunk["timestamp"]),
+                    "component": pd.Categorical.from_codes(chunk[component], dtype=components),
+                    "power": np.array(chunk[power])
+                })
+
+    def get_data(self, segments=None):
+        for chunk in self.iter_chunks(segments):
+            for timestamp, component, power in zip(chunk["timestamp"].tolist(), chunk["component"], chunk["power"]):
+                yield {"component": component, "timestamp": ns_to_datetime(timestamp), "power": float(power)}
+
+    @staticmethod
+    def translate_component_to_table(component):
+        # package-0/dram -> power_rapl_package_0_dram
+        return "power_rapl_" + re.sub(r"[^a-z0-9]+", "_", component.lower())
+
+
+def create_fake_powercap(root, packages=1, subzones=("core", "dram"), max_energy_range_uj=262143328850):
+    # Same layout as /sys/class/powercap, so the listener can run without RAPL hardware
+    zones = []
+    for package in range(packages):
+        zones.append(("intel-rapl:" + str(package), "package-" + str(package)))
+
+        for i, subzone in enumerate(subzones):
+            zones.append(("intel-rapl:" + str(package) + ":" + str(i), subzone))
+
+    for zone, name in zones:
+        zone_dir = path.join(root, zone)
+        os.makedirs(zone_dir, exist_ok=True)
+
+        for filename, value in [("name", name), ("max_energy_range_uj", max_energy_range_uj), ("energy_uj", 0)]:
+            with open(path.join(zone_dir, filename), "w") as out_file:
+                out_file.write(str(value) + "\n")
+
+    return [path.join(root, x[0], "energy_uj") for x in zones]
+
+
+def advance_fake_counter(energy_path, energy_uj, max_energy_range_uj=262143328850):
+    with open(energy_path, "r+") as energy_file:
+        value = (int(energy_file.read()) + int(energy_uj)) % (max_energy_range_uj + 1)
+
+        # Same width for every write, so a concurrent pread never sees a partial number
+        energy_file.seek(0)
+        energy_file.write(str(value).zfill(20) + "\n")
+
+
+def main():
+    powercap_root = settings.POWERCAP_ROOT
+
+    if not path.exists(powercap_root) or not any(ZONE_PATTERN.match(x) for x in os.listdir(powercap_root)):
+        powercap_root = tempfile.mkdtemp()
+        counters = create_fake_powercap(powercap_root, max_energy_range_uj=10 ** 6)
+    else:
+        counters = []
+
+    listener = RAPLListener(powercap_root=powercap_root)
+    listener.start()
+
+    # Fake counters draw 50 W per zone and wrap around every 20 ms
+    for _ in range(100):
+        for counter in counters:
+            advance_fake_counter(counter, 50 * 0.01 * 1e6, max_energy_range_uj=10 ** 6)
+
+        time.sleep(0.01)
+
+    segments = listener.seal_segment()
+    listener.stop()
+
+    for chunk in listener.iter_chunks(segments):
+        print(chunk.groupby("component", observed=True)["power"].describe())
+
+    print(listener.get_timing_stats())
+    listener.discard_segments(listener.sealed_segments() + [listener.segment_path(listener.segment_seq)])
+
+
+if __name__ == '__main__':
+    main()
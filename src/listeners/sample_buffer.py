@@ -0,0 +1,146 @@
+import mmap
+import struct
+
+import numpy as np
+
+from settings import settings
+
+MAGIC = b"GCSAMPLE"
+
+# magic, record size, capacity in records, records written so far
+HEADER = struct.Struct("<8sIQQ")
+COUNT = struct.Struct("<Q")
+COUNT_OFFSET = HEADER.size - COUNT.size
+
+# Record layout shared by all listeners that report power per outlet/host
+POWER_FIELDS = [
+    ("timestamp", "q"),  # ns since epoch
+    ("outlet", "i"),
+    ("power_active", "f"),  # W
+    ("power_apparent", "f"),
+    ("current", "f"),
+    ("voltage", "f")
+]
+
+# Record layout shared by all listeners that report one power value per component, e.g. Arduino and RAPL
+COMPONENT_FIELDS = [
+    ("timestamp", "q"),  # ns since epoch
+    ("component", "B"),
+    ("power", "f")
+]
+
+
+def create_dtype(fields):
+    return np.dtype([(name, "<" + code) for name, code in fields])
+
+
+class SampleBuffer:
+    # Fixed-size records in a memory-mapped file. A full file is doubled up to max_capacity, the file is sparse,
+    # so only written records take disk space. Beyond max_capacity the oldest records are overwritten, the header
+    # keeps the total number of appended records to restore the order.
+    def __init__(self, path, fields, capacity=settings.BUFFER_CAPACITY, max_capacity=settings.BUFFER_MAX_CAPACITY):
+        self.path = path
+        self.fields = fields
+        self.record = struct.Struct("<" + "".join(x[1] for x in fields))
+        self.capacity = capacity
+        self.max_capacity = max(capacity, max_capacity)
+        self.count = 0
+        self.overran = False
+
+        self.file = open(path, "w+b")
+        self.buffer = None
+        self.__map(capacity)
+
+    def __map(self, capacity):
+        size = HEADER.size + capacity * self.record.size
+
+        if self.buffer is not None:
+            self.buffer.flush()
+            self.buffer.close()
+
+        self.file.truncate(size)
+        self.buffer = mmap.mmap(self.file.fileno(), size)
+        self.capacity = capacity
+
+        # The capacity is stored before the count passes the old one, so readers never take the growth for a wrap
+        HEADER.pack_into(self.buffer, 0, MAGIC, self.record.size, capacity, self.count)
+
+    def __make_room(self, count):
+        # Makes room for count records, the ring only wraps once the file cannot grow anymore
+        if count <= self.capacity:
+            return
+
+        if self.capacity < self.max_capacity:
+            capacity = self.capacity
+            while capacity < count and capacity < self.max_capacity:
+                capacity *= 2
+
+            self.__map(min(capacity, self.max_capacity))
+
+        if count > self.capacity and not self.overran:
+            self.overran = True
+            print("[Buffer] " + self.path + " is full at " + str(self.capacity)
+                  + " records, the oldest samples are overwritten until the segment is sealed")
+
+    def append(self, *values):
+        self.__make_room(self.count + 1)
+
+        self.record.pack_into(self.buffer, HEADER.size + (self.count % self.capacity) * self.record.size, *values)
+        self.count += 1
+
+        # Publish the record only after it has been written completely
+        COUNT.pack_into(self.buffer, COUNT_OFFSET, self.count)
+
+    def append_many(self, rows):
+        self.__make_room(self.count + len(rows))
+
+        record = self.record
+        buffer = self.buffer
+        capacity = self.capacity
+        count = self.count
+
+        for row in rows:
+            record.pack_into(buffer, HEADER.size + (count % capacity) * record.size, *row)
+            count += 1
+
+        self.count = count
+        COUNT.pack_into(buffer, COUNT_OFFSET, count)
+
+    def flush(self):
+        self.buffer.flush()
+
+    def close(self):
+        if self.buffer is not None:
+            if self.overran:
+                print("[Buffer] " + self.path + " lost " + str(self.count - self.capacity) + " samples to overwriting")
+
+            self.buffer.flush()
+            self.buffer.close()
+            self.file.close()
+
+            self.buffer = None
+            self.file = None
+
+
+def read_samples(path, fields):
+    dtype = create_dtype(fields)
+
+    with open(path, "rb") as in_file:
+        magic, record_size, capacity, count = HEADER.unpack(in_file.read(HEADER.size))
+
+    if magic != MAGIC or record_size != dtype.itemsize:
+        raise ValueError("Unexpected sample buffer format in " + path)
+
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+
+    # Zero-copy view onto the file, unless the ring wrapped and has to be put back in order
+    records = np.memmap(path, dtype=dtype, mode="r", offset=HEADER.size, shape=(min(count, capacity),))
+
+    if count <= capacity:
+        return records
+
+    print("[Buffer] " + path + " overran, " + str(count - capacity) + " oldest samples were overwritten")
+    start = count % capacity
+
+    return np.concatenate((records[start:], records[:start]))
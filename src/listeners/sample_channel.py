@@ -0,0 +1,95 @@
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from listeners.sample_buffer import create_dtype
+from listeners.stage import Stage
+from settings import settings
+
+# Records written by the producer, records read by the consumer, records dropped because the ring was full
+COUNTER = struct.Struct("<Q")
+WRITTEN_OFFSET = 0
+READ_OFFSET = COUNTER.size
+DROPPED_OFFSET = 2 * COUNTER.size
+HEADER_SIZE = 3 * COUNTER.size
+
+
+class SampleChannel:
+    # Single producer, single consumer ring in a shared memory-mapped file. The consumer creates it, the producer
+    # process maps it by its path. Each side only ever writes its own counter and publishes it after the records,
+    # so no lock is needed. The counters are aligned 8 byte stores, which do not tear on the platforms the
+    # listeners run on.
+    def __init__(self, width, capacity=settings.CHANNEL_CAPACITY, path=None):
+        self.fields = [("timestamp", "q"), ("channel", "i")] + [("value" + str(i), "d") for i in range(width)]
+        self.dtype = create_dtype(self.fields)
+        self.record = struct.Struct("<" + "".join(x[1] for x in self.fields))
+
+        # The side that creates the file removes it again on close
+        self.is_owner = path is None
+        if self.is_owner:
+            handle, path = tempfile.mkstemp(prefix="sample_channel.", dir=settings.CHANNEL_DIR)
+            os.ftruncate(handle, HEADER_SIZE + capacity * self.record.size)
+        else:
+            handle = os.open(path, os.O_RDWR)
+
+        self.path = path
+        self.buffer = mmap.mmap(handle, 0)
+        self.capacity = (len(self.buffer) - HEADER_SIZE) // self.record.size
+        os.close(handle)
+
+        # Local copies of the own counter, the shared one is only written
+        self.written = 0
+        self.read = 0
+        self.dropped = 0
+
+    def put(self, timestamp, channel, values):
+        read = COUNTER.unpack_from(self.buffer, READ_OFFSET)[0]
+
+        # Samples are dropped instead of blocking the listener when the consumer falls behind
+        if self.written - read >= self.capacity:
+            self.dropped += 1
+            COUNTER.pack_into(self.buffer, DROPPED_OFFSET, self.dropped)
+            return False
+
+        self.record.pack_into(self.buffer, HEADER_SIZE + (self.written % self.capacity) * self.record.size,
+                              timestamp, channel, *values)
+        self.written += 1
+        COUNTER.pack_into(self.buffer, WRITTEN_OFFSET, self.written)
+
+        return True
+
+    def get(self):
+        written = COUNTER.unpack_from(self.buffer, WRITTEN_OFFSET)[0]
+
+        if written == self.read:
+            return np.empty(0, dtype=self.dtype)
+
+        records = np.frombuffer(self.buffer, dtype=self.dtype, count=self.capacity, offset=HEADER_SIZE)
+        records = records[np.arange(self.read, written) % self.capacity]
+
+        # The copy above is done, so the producer may overwrite the slots
+        self.read = written
+        COUNTER.pack_into(self.buffer, READ_OFFSET, self.read)
+
+        return records
+
+    def get_dropped(self):
+        return COUNTER.unpack_from(self.buffer, DROPPED_OFFSET)[0]
+
+    def close(self):
+        self.buffer.close()
+
+        if self.is_owner:
+            os.remove(self.path)
+
+
+class ChannelStage(Stage):
+    # Hands the samples of a listener running in another process to a SampleChannel
+    def __init__(self, channel):
+        self.channel = channel
+
+    def push(self, timestamp, channel, values):
+        self.channel.put(timestamp, channel, values)
@@ -0,0 +1,105 @@
+import collections
+import math
+import time
+
+
+class SampleScheduler:
+    # Policies for ticks whose deadline already passed when the listener becomes ready again
+    SKIP = "skip"  # drop every missed tick and wait for the next tick on the grid
+    COALESCE = "coalesce"  # take one sample immediately in place of all missed ticks
+
+    def __init__(self, sample_rate, catch_up=SKIP, history=1024):
+        if sample_rate <= 0:
+            raise ValueError("Sample rate has to be positive")
+
+        if catch_up not in (SampleScheduler.SKIP, SampleScheduler.COALESCE):
+            raise ValueError("Unknown catch up policy: " + str(catch_up))
+
+        self.sample_rate = sample_rate
+        self.sample_interval = 1 / sample_rate
+        self.catch_up = catch_up
+
+        # (monotonic start time, jitter, time since the previous sample) of the most recent samples. The time is
+        # None for the first sample after a restart, so pauses do not count towards the achieved rate.
+        self.history = collections.deque(maxlen=history)
+        self.last_record = None
+
+        self.origin = None
+        self.tick = 0
+        self.deadline = None
+
+        self.samples = 0
+        self.missed_ticks = 0
+
+    def restart(self):
+        # Re-anchor the tick grid, e.g. after a pause. Counters are kept.
+        self.origin = None
+        self.last_record = None
+
+    def next_delay(self):
+        now = time.monotonic()
+
+        if self.origin is None:
+            self.origin = now
+            self.tick = 0
+            self.deadline = now
+            return 0
+
+        # Deadlines are absolute multiples of the interval from the origin, so sampling does not drift
+        # with the time spent inside a sample.
+        self.deadline = self.origin + self.tick * self.sample_interval
+
+        if now <= self.deadline:
+            return self.deadline - now
+
+        late_ticks = int((now - self.deadline) / self.sample_interval)
+
+        if late_ticks > 0:
+            if self.catch_up == SampleScheduler.SKIP:
+                late_ticks += 1
+
+            self.missed_ticks += late_ticks
+            self.tick += late_ticks
+            self.deadline = self.origin + self.tick * self.sample_interval
+
+        return max(0, self.deadline - now)
+
+    def record(self):
+        now = time.monotonic()
+
+        interval = None if self.last_record is None else now - self.last_record
+        self.last_record = now
+
+        self.history.append((now, now - self.deadline, interval))
+        self.samples += 1
+        self.tick += 1
+
+    def get_stats(self):
+        jitter = sorted(x[1] for x in self.history)
+
+        # Only the time between samples of the same active stretch is counted
+        intervals = [x[2] for x in self.history if x[2] is not None]
+
+        achieved_rate = 0
+        if len(intervals) > 0 and sum(intervals) > 0:
+            achieved_rate = len(intervals) / sum(intervals)
+
+        return {
+            "sample_rate": self.sample_rate,
+            "achieved_rate": achieved_rate,
+            "samples": self.samples,
+            "missed_ticks": self.missed_ticks,
+            "jitter_p50": SampleScheduler.__percentile(jitter, 50),
+            "jitter_p95": SampleScheduler.__percentile(jitter, 95),
+            "jitter_p99": SampleScheduler.__percentile(jitter, 99),
+            "jitter_max": jitter[-1] if len(jitter) > 0 else None
+        }
+
+    @staticmethod
+    def __percentile(sorted_values, percent):
+        if len(sorted_values) == 0:
+            return None
+
+        rank = int(math.ceil(percent / 100 * len(sorted_values))) - 1
+
+        return sorted_values[max(0, rank)]
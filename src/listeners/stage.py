@@ -0,0 +1,19 @@
+import abc
+
+
+class Stage(metaclass=abc.ABCMeta):
+    # Processes the samples of a listener while they are written. Stages run in the listening thread,
+    # so push has to stay cheap.
+
+    @abc.abstractmethod
+    def push(self, timestamp, channel, values):
+        pass
+
+    def open(self, segment_path):
+        pass
+
+    def close(self):
+        pass
+
+    def files(self, segment_path):
+        return []
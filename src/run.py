@@ -1,15 +1,19 @@
 import argparse
 import atexit
 import json
+import socket
+import time
 
 from data_collector.data_collector import DataCollector
-from database.database import Database
+from database.backend import open_database
 from environments.slurm_environment import SlurmEnvironment
 from evaluation.plotter import Plotter
 from execution.benchmark import Benchmark
 from execution.run_specification import RunSpecification
 from feature_model.feature_model import FeatureModel
 from listeners.pdu_listener import PDUListener
+from listeners.process_listener import ProcessListener
+from listeners.rapl_listener import RAPLListener
 from sampling.sampler import sample_configs
 from settings import settings
 from train.model_trainer import ModelTrainer
@@ -21,10 +25,14 @@ class Launcher:
         print("[LAUNCH] Initialize")
         self.id_cache = {}
 
-        self.db = Database(args.u, args.p)
+        self.db = open_database(args.u, args.p)
         self.data_collector = DataCollector(self.db, dry_run=settings.DATA_DRY_RUN)
-        # self.data_collector.add_listener(ArduinoPowerListener())
-        self.data_collector.add_listener(PDUListener(sample_rate=2))
+        # self.add_listener(ArduinoPowerListener)
+        self.add_listener(PDUListener, sample_rate=2)
+
+        # The powercap counters are local, samples are tied to the benchmark node they are read on
+        if socket.gethostname().split(".")[0] == settings.RAPL_HOST:
+            self.add_listener(RAPLListener, host=settings.RAPL_HOST)
 
         feature_model = FeatureModel(path_handler.model_path)
         self.sampled_configs = sample_configs(feature_model)
@@ -36,6 +44,14 @@ class Launcher:
 
         self.model_trainer = ModelTrainer(self.db)
 
+    def add_listener(self, listener_class, **config):
+        if settings.LISTENERS_IN_PROCESS:
+            listener = ProcessListener(listener_class, **config)
+        else:
+            listener = listener_class(**config)
+
+        self.data_collector.add_listener(listener)
+
     def launch(self):
         self.sync_with_db()
 
@@ -46,6 +62,9 @@ class Launcher:
         print("[LAUNCH] Execute benchmark")
         self.environment.execute(self.benchmark)
 
+        # Runs are numbered when they are collected, IDs are reserved per batch and need not be consecutive
+        self.id_cache["run_sched"] = list(self.data_collector.run_ids)
+
         if self.data_collector.listeners is not None:
             for listener in self.data_collector.listeners:
                 listener.stop()
@@ -91,28 +110,29 @@ class Launcher:
                                                         [settings.BENCHMARK["name"], bench_cmd])
         self.benchmark.id = self.id_cache["benchmark"]
 
-        for config in self.sampled_configs:
-            feature_hash = config.compute_hash()
-            bin_features = config.get_binary_features()
-            num_features = config.get_numeric_features()
+        # IDs of all configurations and run specifications are resolved in batches instead of one by one
+        start_time = time.time()
+        feature_hashes = [x.compute_hash() for x in self.sampled_configs]
+
+        config_ids = self.db.request_ids(
+            "conf_sw", "feature_hash", feature_hashes,
+            [[feature_hash, json.dumps(config.get_binary_features()), json.dumps(config.get_numeric_features())]
+             for feature_hash, config in zip(feature_hashes, self.sampled_configs)])
 
-            config.id = self.db.request_id("conf_sw", "feature_hash", feature_hash,
-                                           [feature_hash, json.dumps(bin_features), json.dumps(num_features)])
+        run_specs = [[self.id_cache["hw_conf"], self.id_cache["sw_system"], 0, x, self.benchmark.id]
+                     for x in config_ids]
+        run_ids = self.db.request_ids("run_spec", ["hw_conf", "sw_system", "sw_version", "sw_conf", "benchmark"],
+                                      run_specs, run_specs)
 
-            run_id = self.db.request_id("run_spec",
-                                        ["hw_conf", "sw_system", "sw_version", "sw_conf", "benchmark"],
-                                        [self.id_cache["hw_conf"], self.id_cache["sw_system"], 0, config.id,
-                                         self.benchmark.id],
-                                        [self.id_cache["hw_conf"], self.id_cache["sw_system"], 0, config.id,
-                                         self.benchmark.id])
+        for config, config_id, run_id in zip(self.sampled_configs, config_ids, run_ids):
+            config.id = config_id
 
             self.benchmark.add_run(
                 RunSpecification(run_id, config, hw_conf_id)
             )
 
-        sched_id = self.db.get_free_index("run_schedule")
-        self.id_cache["run_sched"] = [x for x in
-                                      range(sched_id, sched_id + settings.RUN_REPETITIONS * len(self.benchmark.runs))]
+        print("[LAUNCH] Synced " + str(len(self.sampled_configs)) + " configurations in "
+              + str(round(time.time() - start_time, 2)) + "s")
 
     def shutdown(self):
         print("[LAUNCH] Shutdown...")
@@ -130,6 +150,12 @@ def main():
     if fixed_data is None:
         launcher.launch()
 
+        # Runs of a dry run only have IDs in the staging file until it is loaded
+        if settings.DATA_DRY_RUN:
+            print("[LAUNCH] Campaign staged in " + path_handler.staging_path)
+            atexit.register(launcher.shutdown)
+            return
+
     launcher.train_models(fixed_data)
     launcher.evaluate(fixed_data)
 
@@ -138,9 +164,13 @@ def main():
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("-u", metavar="db_user", type=str, required=True, help="user name to connect to the db server")
-    parser.add_argument("-p", metavar="db_password", type=str, required=True, help="associated password to connect to "
-                                                                                   "the db server")
+
+    # The local SQLite snapshot needs no credentials
+    needs_login = settings.DB_BACKEND == "mysql"
+    parser.add_argument("-u", metavar="db_user", type=str, required=needs_login,
+                        help="user name to connect to the db server")
+    parser.add_argument("-p", metavar="db_password", type=str, required=needs_login,
+                        help="associated password to connect to the db server")
 
     args = parser.parse_args()
 
@@ -13,8 +13,27 @@ BINARY_SAMPLER = AllCombinations()
 # NUMERIC_SAMPLER = NAllCombinations()
 NUMERIC_SAMPLER = CentralComposite()
 
-DATA_DRY_RUN = False
+DATA_DRY_RUN = False  # stage collected rows in a local file, load them with data_collector/staging_store.py
 DATA_BUFFER_TIME = 5 * 60  # seconds
+DATA_PARSE_WORKERS = 4  # processes parsing the .ldjson result files during collect
+DATA_INSERT_BATCH_SIZE = 5000  # runs inserted at once while the remaining files are parsed
+# run_eval column -> aggregate of the PDU power of the run (count, mean, min, max or energy in Wh)
+RUN_EVAL_AGGREGATES = {"power": "mean"}
+# Windows in seconds that listeners aggregate samples into while sampling. DATA_INGEST_RESOLUTION picks
+# one of them to be stored instead of the raw samples, None ingests raw samples.
+DOWNSAMPLING_RESOLUTIONS = [1, 10]
+DATA_INGEST_RESOLUTION = None
+
+BUFFER_CAPACITY = 2 ** 20  # records per listener buffer file
+BUFFER_MAX_CAPACITY = 2 ** 24  # records a full buffer file grows to, about a day of 48 outlets at 4 Hz
+ARDUINO_BUFFER_CAPACITY = 2 ** 25  # records, roughly 30 min of all channels at full rate
+ARDUINO_BUFFER_MAX_CAPACITY = 2 ** 27  # records, roughly 2 h of all channels at full rate
+ARDUINO_CHUNK_SIZE = 2 ** 18  # records per chunk loaded from the fine-grained buffer
+CHANNEL_CAPACITY = 2 ** 16  # samples in flight from a listener process to the orchestrator
+CHANNEL_DIR = "/dev/shm"  # memory-backed file system for the channel files, so they never reach a disk
+
+# Host every listener in its own process, so the orchestrator's work does not cause sampling jitter
+LISTENERS_IN_PROCESS = False
 
 SLURM_PARTITION = Slurm.PARTITION_TESLA.value
 SLURM_NODE_CONF = Slurm.NODES_COARSE.value
@@ -25,5 +44,24 @@ RUN_REPETITIONS = 5
 # BENCHMARK = {"name": "locate", "model-path": "locate/locate.xml", "config-path": "locate/locate_bench_config.json"}
 BENCHMARK = {"name": "blender", "model-path": "blender/blender.xml", "config-path": "blender/blender_bench_config.json"}
 
+PDU_HOST = "pdu001.medien.uni-weimar.de"
+PDU_REQUEST_TIMEOUT = 1  # seconds
+PDU_SOCKET_PATH = "/tmp/green_configurator_pdu.sock"  # live queries of capture_pdu.py -daemon
+PDU_LIVE_HISTORY = 15 * 60  # seconds of samples kept in memory per outlet by the daemon
+PDU_SEGMENT_ROTATION = 60 * 60  # seconds after which the daemon seals its segment
+PDU_SEGMENTS_KEPT = 24  # sealed segments the daemon keeps on disk, older ones are discarded
+
+POWERCAP_ROOT = "/sys/class/powercap"
+RAPL_SAMPLE_RATE = 100  # Hz
+RAPL_HOST = "tesla002"  # benchmark node whose RAPL counters are sampled, only readable by a launcher running on it
+
 DB_HOST = "intelli001.medien.uni-weimar.de"
 DB_NAME = "green_configurator"
+DB_BACKEND = "mysql"  # or "sqlite" to work on the local snapshot written by database/sqlite_database.py
+DB_POOL_SIZE = 4  # connections, one per thread using the database at the same time
+DB_RETRIES = 3  # reconnect attempts and repetitions of a read when the connection was lost
+DB_RETRY_DELAY = 5  # seconds between reconnect attempts
+DB_LOOKUP_BATCH_SIZE = 1000  # keys looked up with one statement by request_ids
+DB_READ_CHUNK_SIZE = 50000  # rows per DataFrame streamed by Database.iter_frames
+DB_INSERT_CHUNK_BYTES = 2 ** 21  # per insert statement, well below the 4 MiB default max_allowed_packet
+DB_LOAD_DATA_THRESHOLD = 20000  # rows from which inserts use LOAD DATA LOCAL INFILE, None always uses inserts
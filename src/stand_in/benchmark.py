@@ -0,0 +1,267 @@
+import argparse
+import datetime
+import json
+import os
+import os.path as path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from listeners.arduino_power_listener import ArduinoPowerListener
+from listeners.pdu_listener import PDUListener
+from listeners.rapl_listener import RAPLListener
+from listeners.rapl_listener import create_fake_powercap
+from stand_in.fake_arduino import FakeArduino
+from stand_in.pdu_server import start_pdu_server
+from utility import path_handler
+from utility.utilities import now_ns
+
+# A rate counts as sustained if the listener achieves this share of it
+SUSTAINED_RATIO = 0.95
+
+PDU_RATES = [4, 16, 64, 256]  # Hz
+RAPL_RATES = [100, 500, 1000, 2000]  # Hz
+ARDUINO_FRAME_RATES = [250, 1000, 4000]  # frames per second and component
+ARDUINO_PORTS = [("H", "I", "J", "K"), ("A", "B", "C", "D", "E", "F", "L", "M")]
+
+
+def measure(listener, duration, count_samples, newest_timestamp):
+    # CPU time of the whole process, the stand-ins run in their own processes
+    cpu_start = time.process_time()
+    time.sleep(duration)
+
+    seal_start = time.perf_counter()
+    segments = listener.seal_segment()
+    seal_time = time.perf_counter() - seal_start
+    cpu_time = time.process_time() - cpu_start
+
+    samples = count_samples(listener, duration)
+
+    read_start = time.perf_counter()
+    records = sum(1 for _ in listener.get_data(segments))
+    read_time = time.perf_counter() - read_start
+
+    newest = newest_timestamp(listener, segments)
+    end_to_end = (now_ns() - newest) / 1e9 if newest is not None else None
+
+    return {
+        "duration": duration,
+        "samples": samples,
+        "records": records,
+        "cpu_per_sample_us": cpu_time / samples * 1e6 if samples > 0 else None,
+        "seal_s": seal_time,
+        "read_s": read_time,
+        "read_records_per_s": records / read_time if read_time > 0 else None,
+        "end_to_end_s": end_to_end
+    }
+
+
+def discard(listener):
+    listener.discard_segments(listener.sealed_segments() + [listener.segment_path(listener.segment_seq)])
+
+
+def newest_in_chunks(listener, segments):
+    newest = None
+    for chunk in listener.iter_chunks(segments):
+        if len(chunk) > 0:
+            newest = max(newest or 0, int(chunk["timestamp"].max()))
+
+    return newest
+
+
+def benchmark_pdu(duration, outlet_count, latency):
+    process, host = start_pdu_server(outlet_count=outlet_count, latency=latency)
+    steps = []
+
+    def count_samples(listener, _):
+        return listener.get_timing_stats()["samples"]
+
+    def newest_timestamp(listener, segments):
+        records = listener.get_arrays(segments)
+        return int(records["timestamp"].max()) if len(records) > 0 else None
+
+    try:
+        for rate in PDU_RATES:
+            listener = PDUListener(sample_rate=rate, pdus={host: range(1, outlet_count + 1)})
+            listener.start()
+
+            step = measure(listener, duration, count_samples, newest_timestamp)
+            stats = listener.get_timing_stats()
+            listener.stop()
+            discard(listener)
+
+            step.update({"rate": rate, "achieved_rate": stats["achieved_rate"], "missed_ticks": stats["missed_ticks"],
+                         "jitter_p95": stats["jitter_p95"]})
+            steps.append(step)
+            print("[Benchmark] PDU " + str(rate) + " Hz: " + str(round(stats["achieved_rate"], 2)) + " Hz achieved")
+    finally:
+        process.terminate()
+
+    return {"unit": "tick", "outlets": outlet_count, "latency": latency, "steps": steps}
+
+
+def benchmark_rapl(duration):
+    powercap_root = tempfile.mkdtemp()
+    create_fake_powercap(powercap_root, packages=2)
+    steps = []
+
+    def count_samples(listener, _):
+        return listener.get_timing_stats()["samples"]
+
+    try:
+        for rate in RAPL_RATES:
+            listener = RAPLListener(powercap_root=powercap_root, sample_rate=rate)
+            listener.start()
+
+            step = measure(listener, duration, count_samples, newest_in_chunks)
+            stats = listener.get_timing_stats()
+            listener.stop()
+            discard(listener)
+
+            step.update({"rate": rate, "achieved_rate": stats["achieved_rate"], "missed_ticks": stats["missed_ticks"],
+                         "jitter_p95": stats["jitter_p95"]})
+            steps.append(step)
+            print("[Benchmark] RAPL " + str(rate) + " Hz: " + str(round(stats["achieved_rate"], 2)) + " Hz achieved")
+    finally:
+        shutil.rmtree(powercap_root)
+
+    return {"unit": "tick", "steps": steps}
+
+
+def benchmark_arduino(duration):
+    steps = []
+
+    for frame_rate in ARDUINO_FRAME_RATES:
+        arduinos = [FakeArduino(components, frame_rate=frame_rate) for components in ARDUINO_PORTS]
+        listener = ArduinoPowerListener(ports=[x.port for x in arduinos])
+        listener.start()
+
+        for arduino in arduinos:
+            arduino.start()
+
+        # Frames buffered during the start-up are not counted
+        listener.get_channel_rates()
+        rates = {}
+
+        def count_samples(listener, duration):
+            rates.update(listener.get_channel_rates())
+            return int(sum(rates.values()) * duration)
+
+        try:
+            step = measure(listener, duration, count_samples, newest_in_chunks)
+        finally:
+            for arduino in arduinos:
+                arduino.stop()
+
+            # Ports are closed by the listener before the ptys go away
+            listener.stop()
+            discard(listener)
+
+            for arduino in arduinos:
+                arduino.close()
+
+        rate = frame_rate * sum(len(x) for x in ARDUINO_PORTS)
+
+        step.update({"rate": rate, "achieved_rate": sum(rates.values())})
+        steps.append(step)
+        print("[Benchmark] Arduino " + str(rate) + " frames/s: " + str(round(step["achieved_rate"], 2))
+              + " frames/s achieved")
+
+    return {"unit": "frame", "steps": steps}
+
+
+def summarize(result):
+    sustained = [x["rate"] for x in result["steps"] if x["achieved_rate"] >= SUSTAINED_RATIO * x["rate"]]
+    result["max_sustained_rate"] = max(sustained) if len(sustained) > 0 else 0
+
+    return result
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+
+    for name, result in results["listeners"].items():
+        if name not in baseline["listeners"]:
+            continue
+
+        base = baseline["listeners"][name]
+
+        if result["max_sustained_rate"] < base["max_sustained_rate"]:
+            regressions.append(name + ": max sustained rate " + str(result["max_sustained_rate"]) + " < "
+                               + str(base["max_sustained_rate"]))
+
+        base_steps = {x["rate"]: x for x in base["steps"]}
+        for step in result["steps"]:
+            base_step = base_steps.get(step["rate"])
+
+            if base_step is None or base_step["cpu_per_sample_us"] is None or step["cpu_per_sample_us"] is None:
+                continue
+
+            if step["cpu_per_sample_us"] > base_step["cpu_per_sample_us"] * (1 + tolerance):
+                regressions.append(name + " at " + str(step["rate"]) + ": " + str(round(step["cpu_per_sample_us"], 2))
+                                   + "us CPU per " + result["unit"] + " > "
+                                   + str(round(base_step["cpu_per_sample_us"], 2)) + "us")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the listeners against local stand-ins for their hardware")
+    parser.add_argument("-listeners", nargs="+", choices=["pdu", "arduino", "rapl"], default=["pdu", "arduino", "rapl"])
+    parser.add_argument("-duration", metavar="seconds", type=float, default=3, help="duration of every rate step")
+    parser.add_argument("-outlets", type=int, default=9)
+    parser.add_argument("-latency", metavar="seconds", type=float, default=0.005, help="response latency of the PDU")
+    parser.add_argument("-output", metavar="file", default=None)
+    parser.add_argument("-baseline", metavar="file", default=None, help="results to check for regressions against")
+    parser.add_argument("-tolerance", type=float, default=0.25, help="allowed relative increase of CPU time")
+    args = parser.parse_args()
+
+    # Keep the benchmark segments away from the buffers of a real measurement
+    path_handler.buffer_root = tempfile.mkdtemp()
+
+    results = {
+        "time": datetime.datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "listeners": {}
+    }
+
+    try:
+        if "pdu" in args.listeners:
+            results["listeners"]["pdu"] = summarize(benchmark_pdu(args.duration, args.outlets, args.latency))
+
+        if "arduino" in args.listeners:
+            results["listeners"]["arduino"] = summarize(benchmark_arduino(args.duration))
+
+        if "rapl" in args.listeners:
+            results["listeners"]["rapl"] = summarize(benchmark_rapl(args.duration))
+    finally:
+        shutil.rmtree(path_handler.buffer_root)
+
+    output = args.output
+    if output is None:
+        output = path.join(path_handler.data_root, "benchmarks",
+                           "listeners-" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+
+    os.makedirs(path.dirname(path.abspath(output)), exist_ok=True)
+    with open(output, "w") as out_file:
+        json.dump(results, out_file, indent=2)
+
+    print("[Benchmark] Results written to " + output)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+
+        for regression in regressions:
+            print("[Benchmark] Regression in " + regression)
+
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+import pty
+import time
+
+
+class FakeArduino:
+    # Streams "<component>,<raw value>\n" frames into a pty like the Arduino does over USB serial.
+    # The listener opens the slave side as its port.
+    def __init__(self, components=("H", "I"), frame_rate=1000, batch_interval=0.001):
+        self.components = [x.encode() for x in components]
+        self.frame_rate = frame_rate  # frames per second and component
+        self.batch_interval = batch_interval
+
+        self.master, self.slave = pty.openpty()
+        self.port = os.ttyname(self.slave)
+
+        self.process = None
+
+    def start(self):
+        # The writer runs in its own process, so it does not count towards the listener's CPU time and GIL
+        self.process = multiprocessing.Process(target=self.__write_frames, daemon=True)
+        self.process.start()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    def close(self):
+        self.stop()
+
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __write_frames(self):
+        start = time.monotonic()
+        sent = 0
+        value = 0
+
+        while True:
+            # Frames are written in bursts that catch up with the configured rate
+            due = int((time.monotonic() - start) * self.frame_rate)
+
+            if due > sent:
+                frames = []
+                for _ in range(due - sent):
+                    value = (value + 1) % 1024
+                    frames.extend(component + b"," + str(value).encode() + b"\n" for component in self.components)
+
+                data = b"".join(frames)
+                while len(data) > 0:
+                    data = data[os.write(self.master, data):]
+
+                sent = due
+
+            time.sleep(self.batch_interval)
@@ -0,0 +1,94 @@
+import argparse
+import http.server
+import multiprocessing
+import re
+import socketserver
+import time
+import urllib.parse
+
+from listeners.pdu_decoder import LOCAL_PARAMETER
+from listeners.pdu_decoder import create_sample_response
+
+
+class PDURequestHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive like the PDU, so the listener's sessions reuse their connection
+    protocol_version = "HTTP/1.1"
+
+    # Headers and body go out in separate writes, without this delayed ACKs stall every response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+
+        if url.path != "/cgi/get_param.cgi":
+            self.send_error(404)
+            return
+
+        # Outlets are requested as outlet.name.dev1[9]&..., unknown outlets are left out of the answer like on the PDU
+        outlets = []
+        for outlet in re.findall(r"outlet\.name\.dev1\[(\d+)\]", urllib.parse.unquote(url.query)):
+            if 0 < int(outlet) <= self.server.outlet_count:
+                outlets.append(int(outlet))
+
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+
+        body = create_sample_response(LOCAL_PARAMETER, outlets)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PDUServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    # Answers get_param.cgi like a PDU with the given number of outlets after the given latency
+    daemon_threads = True
+
+    def __init__(self, port=0, outlet_count=24, latency=0):
+        super().__init__(("127.0.0.1", port), PDURequestHandler)
+
+        self.outlet_count = outlet_count
+        self.latency = latency
+
+    def get_host(self):
+        return "127.0.0.1:" + str(self.server_address[1])
+
+
+def serve_pdu(port_queue, outlet_count, latency):
+    server = PDUServer(outlet_count=outlet_count, latency=latency)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_pdu_server(outlet_count=24, latency=0):
+    # The server runs in its own process, so it does not count towards the listener's CPU time and GIL
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_pdu, args=(port_queue, outlet_count, latency), daemon=True)
+    process.start()
+
+    return process, "127.0.0.1:" + str(port_queue.get())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve get_param.cgi like a PDU")
+    parser.add_argument("-port", type=int, default=8080)
+    parser.add_argument("-outlets", type=int, default=24)
+    parser.add_argument("-latency", metavar="seconds", type=float, default=0)
+    args = parser.parse_args()
+
+    server = PDUServer(port=args.port, outlet_count=args.outlets, latency=args.latency)
+    print("[PDU] Serving " + str(args.outlets) + " outlets on " + server.get_host())
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import os
+import os.path as path
+import shutil
+import tempfile
+import unittest
+
+from data_collector.ingest_checkpoint import IngestCheckpoint
+
+
+class IngestCheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.file_path = path.join(self.root, "job-host-measures.ldjson")
+        self.checkpoint = IngestCheckpoint(path.join(self.root, "ingest_checkpoint.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, lines):
+        with open(self.file_path, "w") as out_file:
+            out_file.write("".join(x + "\n" for x in lines))
+
+    def ingest(self):
+        # Reads the file up to its end, like a collect
+        size, identity, offset = self.checkpoint.stat_file(self.file_path)
+        self.checkpoint.begin({}, files={self.file_path: dict(identity, offset=size)})
+        self.checkpoint.commit()
+
+        return offset
+
+    def test_grown_file_continues_at_offset(self):
+        self.write(["{\"run\": 1}", "{\"run\": 2}"])
+        self.ingest()
+        ingested = path.getsize(self.file_path)
+
+        with open(self.file_path, "a") as out_file:
+            out_file.write("{\"run\": 3}\n")
+
+        self.assertEqual(self.ingest(), ingested)
+
+    def test_recreated_smaller_file_is_read_from_start(self):
+        self.write(["{\"run\": 1, \"host\": \"node-a\"}", "{\"run\": 2, \"host\": \"node-a\"}"])
+        self.ingest()
+
+        # Deleted and copied back under the same name, like fetch_and_clean does before every collect
+        os.remove(self.file_path)
+        self.write(["{\"run\": 3}"])
+
+        size, _, offset = self.checkpoint.stat_file(self.file_path)
+        self.assertEqual(offset, 0)
+        self.assertGreater(size, offset)
+
+    def test_replaced_file_with_reused_inode_is_read_from_start(self):
+        self.write(["{\"run\": 1}", "{\"run\": 2}"])
+        size, identity, _ = self.checkpoint.stat_file(self.file_path)
+        self.checkpoint.files[self.file_path] = dict(identity, offset=size)
+
+        # Same inode and a larger size, only the first line tells the files apart
+        self.write(["{\"run\": 7}", "{\"run\": 8}", "{\"run\": 9}"])
+
+        self.assertEqual(self.checkpoint.stat_file(self.file_path)[2], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os.path as path
+import shutil
+import tempfile
+import unittest
+
+import listeners.rapl_listener as rapl_listener
+from listeners.rapl_listener import RAPLListener
+from listeners.rapl_listener import advance_fake_counter
+from listeners.rapl_listener import create_fake_powercap
+from utility import path_handler
+
+MAX_ENERGY_RANGE_UJ = 10 ** 6 - 1
+
+
+class RAPLListenerTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.buffer_root = path_handler.buffer_root
+        path_handler.buffer_root = path.join(self.root, "buffer")
+
+        self.counters = create_fake_powercap(path.join(self.root, "powercap"), subzones=(),
+                                             max_energy_range_uj=MAX_ENERGY_RANGE_UJ)
+
+        # Samples are 1 ms apart
+        self.clock = iter(range(0, 10 ** 9, 10 ** 6))
+        self.now_ns = rapl_listener.now_ns
+        rapl_listener.now_ns = lambda: next(self.clock)
+
+        # Sampled by hand instead of by the listening thread
+        self.listener = RAPLListener(powercap_root=path.join(self.root, "powercap"), host="test", resolutions=None)
+        self.listener.open()
+
+    def tearDown(self):
+        self.listener.stop()
+
+        rapl_listener.now_ns = self.now_ns
+        path_handler.buffer_root = self.buffer_root
+        shutil.rmtree(self.root)
+
+    def sample(self, energy_uj):
+        advance_fake_counter(self.counters[0], energy_uj, max_energy_range_uj=MAX_ENERGY_RANGE_UJ)
+        self.listener.__listen__()
+
+    def read_power(self):
+        segments = self.listener.seal_segment()
+        return [x for chunk in self.listener.iter_chunks(segments) for x in chunk["power"]]
+
+    def test_power_from_counter_delta(self):
+        self.sample(100000)
+        self.sample(200000)
+
+        # 200000 uJ in 1 ms
+        self.assertAlmostEqual(self.read_power()[0], 200.0, places=3)
+
+    def test_power_across_counter_wrap(self):
+        self.sample(900000)
+
+        # Wraps at max_energy_range_uj + 1, the counter reads 100000 afterwards
+        self.sample(200000)
+        self.sample(200000)
+
+        power = self.read_power()
+        self.assertEqual(len(power), 2)
+        self.assertAlmostEqual(power[0], 200.0, places=3)
+        self.assertAlmostEqual(power[1], 200.0, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
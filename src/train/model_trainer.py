@@ -29,6 +29,12 @@ import train.aggregation as aggregation
 import seaborn as sns
 
 
+# Types of the measurement columns read from the database
+MEASUREMENT_DTYPES = {"timestamp": "datetime64[ns]", "active_power": "float64", "apparent_power": "float64",
+                      "work_begin_time": "datetime64[ns]", "work_end_time": "datetime64[ns]",
+                      "peak_time": "datetime64[ns]"}
+
+
 def mean_absolute_percentage_error(y_true, y_pred):
     y_true, y_pred = np.array(y_true), np.array(y_pred)
     return np.mean(np.abs((y_true - y_pred) / y_true)) * 100
@@ -68,17 +74,16 @@ class ModelTrainer:
     def collect_measurements(self, sched_ids, alignment_strategy, aggregation_strategy):
         metric = "active_power"
 
-        measurements = self.db.execute(
+        # Streamed run by run, only the measurements of one run are held at a time
+        runs = self.db.iter_groups(
             "SELECT s.id, timestamp, power_total_active, power_total_apparent, work_begin_time, work_end_time, peak_time FROM measurements AS m " +
-            "JOIN run_schedule as s ON s.id = m.run WHERE run IN (" + ", ".join(str(x) for x in sched_ids) + ");"
-        )
-
-        df = pd.DataFrame.from_records(measurements,
-                                       columns=["id", "timestamp", "active_power", "apparent_power",
-                                                "work_begin_time", "work_end_time", "peak_time"])
+            "JOIN run_schedule as s ON s.id = m.run WHERE run IN (" + ", ".join(str(x) for x in sched_ids) + ") " +
+            "ORDER BY s.id, timestamp;",
+            ["id", "timestamp", "active_power", "apparent_power", "work_begin_time", "work_end_time", "peak_time"],
+            "id", dtypes=MEASUREMENT_DTYPES)
 
         power_per_run = {}
-        for run in df.groupby("id"):
+        for run in runs:
             filtered_measurements = self.filter_measurements(run[1], alignment_strategy)
             power_per_run[run[1].iloc[0]["id"]] = aggregation_strategy(filtered_measurements, metric)
 
@@ -7,12 +7,16 @@ project_dir = path.abspath(path.join(path.dirname(__file__), "..", ".."))
 resources_root = path.join(project_dir, "resources")
 data_root = path.join(project_dir, "data")
 buffer_root = path.join(data_root, "buffer")
+ingest_checkpoint_path = path.join(data_root, "ingest_checkpoint.json")
+staging_root = path.join(data_root, "staging")
+database_snapshot_path = path.join(data_root, settings.DB_NAME + ".sqlite")
 target_systems_root = path.join(resources_root, "target-systems")
 plot_root = path.join(data_root, "plots")
 model_root = path.join(data_root, "models")
 
 model_path = path.join(target_systems_root, settings.BENCHMARK["model-path"])
 bench_config_path = path.join(target_systems_root, settings.BENCHMARK["config-path"])
+staging_path = path.join(staging_root, settings.BENCHMARK["name"] + ".sqlite")
 
 slurm_script_root = path.join(data_root, "slurm")
 slurm_script_bench_root = path.join(slurm_script_root, settings.BENCHMARK["name"])
@@ -1,4 +1,6 @@
+import datetime
 import sys
+import time
 
 
 def get_size(obj, seen=None):
@@ -20,3 +22,21 @@ def get_size(obj, seen=None):
     elif hasattr(obj, '__iter__') and not isinstance(obj, (str, bytes, bytearray)):
         size += sum([get_size(i, seen) for i in obj])
     return size
+
+
+def now_ns():
+    """Current time as integer nanoseconds since the epoch"""
+    if hasattr(time, "time_ns"):
+        return time.time_ns()
+
+    return int(time.time() * 1e9)
+
+
+def ns_to_datetime(timestamp):
+    """Naive local datetime of a timestamp in ns since the epoch"""
+    return datetime.datetime.fromtimestamp(timestamp / 1e9)
+
+
+def datetime_to_ns(timestamp):
+    """Timestamp in ns since the epoch of a naive local datetime"""
+    return int(round(timestamp.timestamp() * 1e6)) * 1000